@@ -0,0 +1,72 @@
+# measures the cold-start cost of importing architecture_as_code
+#
+# each sample is a fresh interpreter, so nothing is cached in sys.modules.
+# the 'eager' case imports the modules that used to be imported at package import time
+# (redis, pkg_resources and the diagrams stack), to show what the lazy imports save.
+#
+# usage: python benchmarks/bench_import_time.py [--runs 20] [--json results.json]
+import argparse, json, os, statistics, subprocess, sys, time
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+eager_imports = '''
+import redis
+import pkg_resources
+from diagrams import Diagram, Edge, Cluster
+from diagrams.onprem.queue import Kafka
+from diagrams.onprem.container import Docker
+from diagrams.programming.flowchart import Database, MultipleDocuments
+from diagrams.elastic.elasticsearch import Elasticsearch, Kibana, Logstash
+from diagrams.programming.framework import React, Django
+from diagrams.onprem.network import Nginx, Internet, Haproxy
+from diagrams.aws.engagement import SimpleEmailServiceSesEmail
+from diagrams.onprem.compute import Server
+from diagrams.onprem.client import Users
+from diagrams.onprem.inmemory import Redis
+from diagrams.custom import Custom
+'''
+
+cases = {
+    'lazy': 'import architecture_as_code',
+    'eager': 'import architecture_as_code\n' + eager_imports,
+}
+
+
+def time_import(code, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = src_path + os.pathsep + env.get('PYTHONPATH', '')
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the cold import of architecture_as_code')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    # interpreter startup on its own, so it can be subtracted from the other cases
+    baseline = statistics.median(time_import('pass', args.runs))
+    results = {'interpreter_startup_s': baseline, 'cases': {}}
+    for name, code in cases.items():
+        samples = time_import(code, args.runs)
+        median = statistics.median(samples)
+        results['cases'][name] = {'median_s': median, 'import_only_s': median - baseline, 'runs': args.runs}
+        print('%-6s median %.1f ms (%.1f ms excluding interpreter startup)' % (name, median * 1000, (median - baseline) * 1000))
+
+    lazy = results['cases']['lazy']['import_only_s']
+    eager = results['cases']['eager']['import_only_s']
+    if lazy > 0:
+        print('lazy imports are %.1fx faster to import' % (eager / lazy))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
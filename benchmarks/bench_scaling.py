@@ -0,0 +1,143 @@
+# measures how __call__ and generate_architecture_diagram scale with the size of config_main.yaml
+# (drawn with the diagrams package, with renderer='dot', and split into a diagram per category)
+#
+# for each number of services, a synthetic config is generated (see synthetic_config.py) and
+# each target is timed over --runs runs, then run once more under tracemalloc for its peak memory.
+# a target that fails (e.g. the diagram, when graphviz's dot isn't installed) is recorded
+# with its error, and the other targets and sizes still run.
+#
+# usage:
+#   python benchmarks/bench_scaling.py --services 10,100,500 --json results.json
+#   python benchmarks/bench_scaling.py --compare old.json new.json [--threshold 1.2]
+# compare exits with status 1 if any case got slower, or used more memory, by more than the threshold
+import argparse, json, os, platform, statistics, sys, tempfile, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_config import defaults, prefix, synthetic_config
+
+targets = ('call', 'export', 'diagram', 'diagram_dot', 'diagram_split')
+
+
+def prepare(target, config_file_name):
+    # returns the function to time
+    #   generate_architecture_diagram reads the config loaded by __call__, which is done up front.
+    #   diagrams are always re-rendered, rather than read from the cache, and never opened in a viewer
+    #   diagram_dot only writes the graphviz source, so it also runs where graphviz isn't installed
+    #   diagram_split draws the overview and a diagram per top level category, in a process per cpu
+    #   export streams the deployment files to a tar archive, rather than writing them to deployment_files
+    from architecture_as_code import ArchitectureAsCode
+    from architecture_as_code.sinks import TarSink
+    aac = ArchitectureAsCode(prefix)
+    if target == 'call':
+        return lambda: aac(config_main_file_name=config_file_name, incremental=False)
+    if target == 'export':
+        return lambda: aac.export(TarSink(os.devnull), config_file_name)
+    aac(config_main_file_name=config_file_name, incremental=False)
+    if target == 'diagram_dot':
+        return lambda: aac.generate_architecture_diagram(use_cache=False, renderer='dot', outformat='dot')
+    if target == 'diagram_split':
+        return lambda: aac.generate_architecture_diagram(show=False, use_cache=False, split=True, workers=os.cpu_count())
+    return lambda: aac.generate_architecture_diagram(show=False, use_cache=False)
+
+
+def measure(target, config_file_name, runs):
+    try:
+        function = prepare(target, config_file_name)
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        return {'status': 'error', 'error': repr(e)[:500]}
+    return {'status': 'ok', 'median_s': statistics.median(samples), 'min_s': min(samples), 'runs': runs, 'peak_memory_mb': peak / 2 ** 20}
+
+
+def run_benchmarks(args):
+    parameters = {name: getattr(args, name) for name in defaults if name != 'services'}
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': parameters,
+        'cases': {},
+    }
+    cwd = os.getcwd()
+    for services in [int(s) for s in args.services.split(',')]:
+        with tempfile.TemporaryDirectory() as folder:
+            config_file_name = os.path.join(folder, 'config_main.yaml')
+            with open(config_file_name, 'w') as f:
+                f.write(synthetic_config(services=services, **parameters))
+            os.chdir(folder)
+            try:
+                for target in args.targets.split(','):
+                    result = measure(target, config_file_name, args.runs)
+                    results['cases']['%s/%d' % (target, services)] = dict(result, target=target, services=services)
+                    if result['status'] == 'ok':
+                        print('%-13s %6d services  median %8.3f s  peak %8.1f MB' % (target, services, result['median_s'], result['peak_memory_mb']))
+                    else:
+                        print('%-13s %6d services  %s' % (target, services, result['error']))
+            finally:
+                os.chdir(cwd)
+    return results
+
+
+def compare(old_file_name, new_file_name, threshold):
+    # ratio of new / old for each case found in both files
+    with open(old_file_name) as f:
+        old = json.load(f)
+    with open(new_file_name) as f:
+        new = json.load(f)
+    if old.get('parameters') != new.get('parameters'):
+        print('warning: the results were run with different parameters')
+    regressions = []
+    for name, new_case in new['cases'].items():
+        old_case = old['cases'].get(name)
+        if old_case is None or old_case['status'] != 'ok' or new_case['status'] != 'ok':
+            print('%-16s %s -> %s' % (name, old_case['status'] if old_case else 'missing', new_case['status']))
+            if old_case and old_case['status'] == 'ok':
+                regressions.append(name)
+            continue
+        time_ratio = new_case['median_s'] / old_case['median_s']
+        memory_ratio = new_case['peak_memory_mb'] / old_case['peak_memory_mb'] if old_case['peak_memory_mb'] else 1
+        flag = ''
+        if time_ratio > threshold or memory_ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-16s time %.2fx  memory %.2fx%s' % (name, time_ratio, memory_ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how architecture_as_code scales with the size of config_main.yaml')
+    parser.add_argument('--services', default='10,100,500', help='comma separated numbers of services')
+    parser.add_argument('--targets', default=','.join(targets), help='comma separated, from: ' + ', '.join(targets))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files instead of running')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio above which --compare reports a regression')
+    for name, value in defaults.items():
+        if name != 'services':
+            parser.add_argument('--' + name.replace('_', '-'), type=int, default=value)
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    results = run_benchmarks(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# compares the yaml backends and k8s output formats on a large synthetic config, see synthetic_config.py
+#
+# each case regenerates all deployment files from scratch (incremental=False) in a temporary folder.
+# the 'roundtrip / yaml' case is the default, and the one the others are compared against.
+#
+# usage: python benchmarks/bench_yaml_backends.py [--services 200] [--environments 4] [--runs 3] [--json results.json]
+import argparse, json, os, statistics, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from architecture_as_code import ArchitectureAsCode
+from architecture_as_code.yaml_backend import c_accelerated
+from synthetic_config import prefix, synthetic_config
+
+cases = [
+    ('roundtrip', 'yaml'),
+    ('safe', 'yaml'),
+    ('roundtrip', 'json'),
+    ('safe', 'json'),
+]
+
+
+def time_case(config_file_name, yaml_backend, k8s_format, runs):
+    aac = ArchitectureAsCode(prefix)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        aac(config_main_file_name=config_file_name, incremental=False, yaml_backend=yaml_backend, k8s_format=k8s_format)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the yaml backends and k8s output formats')
+    parser.add_argument('--services', type=int, default=200)
+    parser.add_argument('--environments', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = {'services': args.services, 'environments': args.environments, 'c_accelerated': c_accelerated, 'cases': {}}
+    print('libyaml (C) available: %s' % c_accelerated)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        config_file_name = os.path.join(folder, 'config_main.yaml')
+        with open(config_file_name, 'w') as f:
+            f.write(synthetic_config(services=args.services, environments=args.environments))
+        os.chdir(folder)
+        try:
+            for yaml_backend, k8s_format in cases:
+                median = statistics.median(time_case(config_file_name, yaml_backend, k8s_format, args.runs))
+                results['cases'][yaml_backend + '/' + k8s_format] = {'median_s': median, 'runs': args.runs}
+        finally:
+            os.chdir(cwd)
+
+    default = results['cases']['roundtrip/yaml']['median_s']
+    for name, case in results['cases'].items():
+        print('%-15s median %.3f s (%.2fx)' % (name, case['median_s'], default / case['median_s']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
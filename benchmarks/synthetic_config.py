@@ -0,0 +1,106 @@
+# generates synthetic config_main.yaml files for the benchmarks
+#
+# the configs are deterministic, so results can be compared between versions of the package.
+# each container's env vars refer to other services (SERVICE_HOST / SERVICE_PORT), which
+# gives the diagram its edges, plus plain values and hosts resolved per environment.
+#
+# usage: python benchmarks/synthetic_config.py --services 200 --environments 4 > config_main.yaml
+import argparse, sys
+
+prefix = 'BENCH'
+
+defaults = {
+    'services': 50,
+    'containers': 1,             # containers per service
+    'env_vars': 6,               # env vars per container
+    'environments': 3,
+    'volume_mappings': 10,       # volume mappings per environment
+    'ingress_paths': 10,         # services with an ingress
+    'categories': 4,             # top level architecture_categories
+    'category_depth': 2,         # depth of the nested architecture_categories of each service
+}
+
+
+def service_name(s):
+    return prefix.lower() + '-svc' + str(s)
+
+
+def env_var_prefix(s):
+    return service_name(s).upper().replace('-', '_')
+
+
+def synthetic_config(services=defaults['services'], containers=defaults['containers'], env_vars=defaults['env_vars'],
+                     environments=defaults['environments'], volume_mappings=defaults['volume_mappings'],
+                     ingress_paths=defaults['ingress_paths'], categories=defaults['categories'],
+                     category_depth=defaults['category_depth']):
+    lines = ['kind: EnvironmentDetails', 'environments:']
+    for e in range(environments):
+        lines += [
+            '- name: env%d' % e,
+            '  image_registry: registry%d.example.com:5000' % e,
+            '  default_host: 10.0.%d.1' % (e % 256),
+            '  environment_variables:',
+            '  - name: LOG_LEVEL',
+            '    value: info',
+            '    universal: true',
+            '  - name: %s_PASSWORD' % env_var_prefix(0),
+            '    value: secret%d' % e,
+        ]
+        if volume_mappings:
+            lines += ['  volume_mappings:']
+        for v in range(volume_mappings):
+            s = v % services
+            lines += [
+                '  - service_name: ' + service_name(s),
+                '    source: /data/%s/%d' % (service_name(s), v),
+                '    target: /data/%d' % v,
+                '    size: %dGi' % (v % 20 + 1),
+            ]
+
+    lines += ['---', 'kind: ServiceDetails', 'services:']
+    for s in range(services):
+        lines += ['- name: ' + service_name(s)]
+        if s < ingress_paths:
+            lines += ['  ingress_path: /svc%d' % s]
+        if categories and category_depth:
+            # one path of nested categories per service, e.g. Category1 > Category1-2
+            indent = '  '
+            for depth in range(category_depth):
+                name = 'Category%d' % (s % categories) + ''.join('-%d' % ((s // categories) % 2) for _ in range(depth))
+                lines += [indent + 'architecture_categories:', indent + '- name: ' + name]
+                indent += '  '
+        lines += ['  containers:']
+        for c in range(containers):
+            lines += [
+                '  - name: bench-img%d-%d' % (s, c),
+                '    entrypoint: python app.py --port %d' % (8000 + c),
+                '    port_mappings:',
+                '    - target: %d' % (8000 + c),
+            ]
+            if env_vars:
+                lines += ['    environment_variables:']
+            for v in range(env_vars):
+                # cycle through the kinds of env vars, referring to the next few services
+                other = (s + 1 + v // 4) % services
+                kind = v % 4
+                if kind == 0:
+                    lines += ['    - name: %s_SERVICE_SERVICE_HOST' % env_var_prefix(other)]
+                elif kind == 1:
+                    lines += ['    - name: %s_SERVICE_SERVICE_PORT' % env_var_prefix(other), '      include_in_k8: true']
+                elif kind == 2:
+                    lines += ['    - name: SETTING_%d' % v, '      value: %d' % v]
+                else:
+                    lines += ['    - name: %s_PASSWORD' % env_var_prefix(other), '      include_in_k8: true']
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic config_main.yaml to stdout')
+    for name, value in defaults.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=int, default=value)
+    args = parser.parse_args()
+    sys.stdout.write(synthetic_config(**vars(args)))
+
+
+if __name__ == '__main__':
+    main()
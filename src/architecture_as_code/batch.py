@@ -0,0 +1,82 @@
+import os, time
+
+# batch runs generate the deployment files of many projects, each with its own prefix and config_main.yaml,
+# in one process, so imports, yaml instances, parsed templates and redis connection pools are shared between
+# projects, or over a pool of processes, each of them staying warm across the projects it runs
+#
+#   summary = run_batch(load_projects('projects.yaml'), jobs=4)
+#
+# projects.yaml lists the projects, with paths relative to the file
+#   - prefix: WEBAPP
+#     config: webapp/config_main.yaml
+#     output_folder: webapp/deployment_files   # by default, deployment_files next to the config
+#     services_requiring_gpu: [webapp-django]  # and any other argument of ArchitectureAsCode.__call__
+
+
+def new_project(prefix, config, output_folder=None, **call_options):
+    if output_folder is None:
+        output_folder = os.path.join(os.path.dirname(config), 'deployment_files')
+    return dict(call_options, prefix=prefix, config=config, output_folder=output_folder)
+
+
+def load_projects(file_name):
+    from ruamel.yaml import YAML
+    with open(file_name) as f:
+        entries = YAML(typ='safe', pure=True).load(f) or []
+    folder = os.path.dirname(os.path.abspath(file_name))
+    projects = []
+    for entry in entries:
+        if not isinstance(entry, dict) or 'prefix' not in entry or 'config' not in entry:
+            raise ValueError('%s: each project needs a prefix and a config, got %r' % (file_name, entry))
+        for key in ('config', 'output_folder'):
+            if entry.get(key) is not None:
+                entry[key] = os.path.join(folder, entry[key])
+        projects.append(new_project(**entry))
+    return projects
+
+
+def run_project(project):
+    # generates one project, returning its summary, with the error instead of raising it
+    #   report: number of files added, changed, removed and unchanged in each environment
+    from . import ArchitectureAsCode
+    started = time.perf_counter()
+    summary = {'prefix': project['prefix'], 'config': project['config'], 'output_folder': project['output_folder'],
+               'status': 'ok', 'error': None, 'report': None}
+    call_options = {key: value for key, value in project.items() if key not in ('prefix', 'config')}
+    try:
+        report = ArchitectureAsCode(project['prefix'])(config_main_file_name=project['config'], **call_options)
+        summary['report'] = {environment_name: {key: len(values) for key, values in changes.items()}
+                             for environment_name, changes in report.environments.items()}
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = '%s: %s' % (type(e).__name__, e)
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+
+def run_batch(projects, jobs=None, callback=None):
+    # runs the projects, in a pool of jobs processes if jobs > 1, one project failing doesn't stop the others
+    #   callback: called with the summary of each project as it finishes
+    #   returns {'projects': [summary of each project, in the order given], 'failed': number of failed projects, 'seconds'}
+    #   projects are already spread over processes, so with jobs > 1 they shouldn't also set workers
+    started = time.perf_counter()
+    if jobs and jobs > 1 and len(projects) > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        summaries = [None] * len(projects)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(run_project, project): index for index, project in enumerate(projects)}
+            for future in as_completed(futures):
+                summaries[futures[future]] = future.result()
+                if callback is not None:
+                    callback(summaries[futures[future]])
+    else:
+        summaries = []
+        for project in projects:
+            summaries.append(run_project(project))
+            if callback is not None:
+                callback(summaries[-1])
+    return {
+        'projects': summaries,
+        'failed': sum(1 for summary in summaries if summary['status'] != 'ok'),
+        'seconds': time.perf_counter() - started,
+    }
@@ -0,0 +1,197 @@
+import argparse, json, os, sys
+
+# command line interface
+#
+#   architecture-as-code watch WEBAPP --config config_main.yaml --diagram
+#   architecture-as-code batch --projects projects.yaml --jobs 4 --json summary.json
+#   architecture-as-code export WEBAPP --environments prod --k8s-only | kubectl apply -f -
+# also run as python -m architecture_as_code
+
+
+def add_render_arguments(parser):
+    # arguments of ArchitectureAsCode.iter_artifacts
+    parser.add_argument('--gpu', nargs='*', default=[], metavar='SERVICE', help='services requiring a gpu')
+    parser.add_argument('--non-gpu-environment', default='soe', help='environment whose services run without gpu (default: %(default)s)')
+    parser.add_argument('--yaml-backend', default='roundtrip', choices=('roundtrip', 'safe'))
+    parser.add_argument('--k8s-format', default='yaml', choices=('yaml', 'json'))
+    parser.add_argument('--services', nargs='+', metavar='PATTERN', help='only regenerate these services, names or glob patterns')
+    parser.add_argument('--environments', nargs='+', metavar='PATTERN', help='only regenerate these environments, names or glob patterns')
+    parser.add_argument('--bundle', action='store_true', help='write each environment as one k8s-all file and one run_all.sh')
+    parser.add_argument('--kustomize', action='store_true', help='write the k8s files as a kustomize base and an overlay per environment')
+
+
+def add_generation_arguments(parser):
+    # arguments of ArchitectureAsCode.__call__
+    add_render_arguments(parser)
+    parser.add_argument('--workers', type=int, help='number of processes rendering the services')
+    parser.add_argument('--full', action='store_true', help='regenerate all files, rather than only those whose inputs changed')
+    parser.add_argument('--store', nargs='?', const=True, metavar='FOLDER',
+                        help='write each distinct file once, to a content-addressed store linked from the environments (default: <output>/.aac-store)')
+    parser.add_argument('--store-links', default='hardlink', choices=('hardlink', 'symlink', 'copy'), help='(default: %(default)s)')
+    parser.add_argument('--update-monitoring', action='store_true', help='publish the monitoring settings to redis')
+
+
+def add_diagram_arguments(parser):
+    # arguments of ArchitectureAsCode.generate_architecture_diagram
+    parser.add_argument('--diagram', action='store_true', help='also generate the architecture diagram')
+    parser.add_argument('--renderer', default='dot', choices=('diagrams', 'dot'), help='(default: %(default)s)')
+    parser.add_argument('--outformat', default='png', help='(default: %(default)s)')
+    parser.add_argument('--split', action='store_true', help='draw an overview and a diagram per top level category')
+
+
+def render_options(args):
+    return {
+        'services_requiring_gpu': args.gpu,
+        'non_gpu_environment': args.non_gpu_environment,
+        'yaml_backend': args.yaml_backend,
+        'k8s_format': args.k8s_format,
+        'services': args.services,
+        'environments': args.environments,
+        'bundle': args.bundle,
+        'kustomize': args.kustomize,
+    }
+
+
+def call_options(args):
+    return dict(render_options(args), workers=args.workers, incremental=not args.full, update_monitoring=args.update_monitoring,
+                store=args.store, store_links=args.store_links)
+
+
+def diagram_options(args):
+    return {'show': False, 'renderer': args.renderer, 'outformat': args.outformat, 'split': args.split, 'workers': args.workers}
+
+
+def watch(args):
+    from . import ArchitectureAsCode
+    aac = ArchitectureAsCode(args.prefix)
+    print('watching %s, press Ctrl+C to stop' % os.path.abspath(args.config))
+    watcher = aac.watch(args.config, diagram=args.diagram, interval=args.interval, debounce=args.debounce,
+                        diagram_options=diagram_options(args), **call_options(args))
+    print(watcher.latency_summary())
+    return 0
+
+
+def output_format(output):
+    # format of export's output, going by its name
+    if output == '-':
+        return 'stdout'
+    for extension, format in (('.tar.gz', 'tgz'), ('.tgz', 'tgz'), ('.tar', 'tar'), ('.zip', 'zip')):
+        if output.endswith(extension):
+            return format
+    return 'dir'
+
+
+def export(args):
+    from . import ArchitectureAsCode
+    from .sinks import FileSystemSink, StdoutSink, TarSink, ZipSink, k8s_artifacts, write_artifacts
+    format = args.format or output_format(args.output)
+    stdout = args.output == '-'
+    if format == 'dir' and stdout:
+        print('a folder can\'t be written to stdout')
+        return 2
+    # config_main.yaml is loaded, and the selectors checked, before the output is opened,
+    # so a mistake doesn't leave an empty archive behind
+    try:
+        artifacts = ArchitectureAsCode(args.prefix).iter_artifacts(args.config, **render_options(args))
+    except (OSError, ValueError) as e:
+        print('error: %s' % e, file=sys.stderr)
+        return 1
+    if args.k8s_only:
+        artifacts = k8s_artifacts(artifacts)
+    if format == 'stdout':
+        sink = StdoutSink()
+    elif format == 'dir':
+        sink = FileSystemSink(args.output)
+    elif format == 'zip':
+        sink = ZipSink(sys.stdout.buffer if stdout else args.output)
+    else:
+        sink = TarSink(sys.stdout.buffer if stdout else args.output, 'gz' if format == 'tgz' else '')
+    try:
+        with sink:
+            files, total_bytes = write_artifacts(artifacts, sink)
+    except BrokenPipeError:
+        if not stdout and format != 'stdout':
+            raise
+        # the reader closed the pipe, e.g. | head: stdout is pointed at devnull, so flushing it at exit doesn't raise again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    # on stderr, so it doesn't mix with files written to stdout
+    print('%d files, %d bytes' % (files, total_bytes), file=sys.stderr)
+    return 0
+
+
+def parse_project(argument):
+    # PREFIX=CONFIG
+    prefix, separator, config = argument.partition('=')
+    if not separator or not prefix or not config:
+        raise argparse.ArgumentTypeError('expected PREFIX=CONFIG, got %r' % argument)
+    return prefix, config
+
+
+def print_project(summary):
+    if summary['status'] == 'ok':
+        totals = {}
+        for changes in summary['report'].values():
+            for key, count in changes.items():
+                totals[key] = totals.get(key, 0) + count
+        details = ', '.join('%d %s' % (totals.get(key, 0), key) for key in ('added', 'changed', 'removed', 'unchanged'))
+    else:
+        details = ' '.join(summary['error'].split())
+    print('%-20s %-6s %8.3f s  %s' % (summary['prefix'], summary['status'], summary['seconds'], details))
+
+
+def batch(args):
+    from .batch import load_projects, new_project, run_batch
+    projects = load_projects(args.projects) if args.projects else []
+    projects += [new_project(prefix, config) for prefix, config in args.project]
+    if not projects:
+        print('no projects given')
+        return 2
+    # options given on the command line apply to every project, unless set in the projects file
+    projects = [dict(call_options(args), **project) for project in projects]
+    summary = run_batch(projects, jobs=args.jobs, callback=print_project)
+    print('%d projects, %d failed, in %.3f s' % (len(projects), summary['failed'], summary['seconds']))
+    if args.json == '-':
+        json.dump(summary, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='architecture-as-code', description='Generate deployment files and architecture diagrams from config_main.yaml')
+    subparsers = parser.add_subparsers(dest='command')
+
+    watch_parser = subparsers.add_parser('watch', help='regenerate each time config_main.yaml or a template changes')
+    watch_parser.add_argument('prefix', help='prefix of the application, e.g. WEBAPP')
+    watch_parser.add_argument('--config', default='config_main.yaml', help='config_main.yaml file (default: %(default)s)')
+    add_generation_arguments(watch_parser)
+    add_diagram_arguments(watch_parser)
+    watch_parser.add_argument('--interval', type=float, default=0.5, help='seconds between checks for changes (default: %(default)s)')
+    watch_parser.add_argument('--debounce', type=float, default=0.3, help='seconds without changes before regenerating (default: %(default)s)')
+    watch_parser.set_defaults(function=watch)
+
+    batch_parser = subparsers.add_parser('batch', help='generate the deployment files of several projects in one process')
+    batch_parser.add_argument('project', nargs='*', type=parse_project, metavar='PREFIX=CONFIG',
+                              help='prefix and config_main.yaml of a project, its files are written to deployment_files next to the config')
+    batch_parser.add_argument('--projects', metavar='FILE', help='yaml file listing the projects, see batch.py')
+    batch_parser.add_argument('--jobs', type=int, help='number of projects generated in parallel, in separate processes')
+    batch_parser.add_argument('--json', metavar='FILE', help='write the summary of the run to this file, - for stdout')
+    add_generation_arguments(batch_parser)
+    batch_parser.set_defaults(function=batch)
+
+    export_parser = subparsers.add_parser('export', help='render the deployment files to a folder, an archive or stdout, without a manifest')
+    export_parser.add_argument('prefix', help='prefix of the application, e.g. WEBAPP')
+    export_parser.add_argument('--config', default='config_main.yaml', help='config_main.yaml file (default: %(default)s)')
+    export_parser.add_argument('-o', '--output', default='-', help='folder, .tar, .tar.gz, .tgz or .zip file, - for stdout (default: %(default)s)')
+    export_parser.add_argument('--format', choices=('stdout', 'dir', 'tar', 'tgz', 'zip'), help='by default, going by the output')
+    export_parser.add_argument('--k8s-only', action='store_true', help='only the k8s files, e.g. for kubectl apply -f -')
+    add_render_arguments(export_parser)
+    export_parser.set_defaults(function=export)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    return args.function(args)
@@ -0,0 +1,566 @@
+import os, re, shutil, subprocess, time
+
+from .env_vars import EnvironmentContext
+from .instrumentation import NullTracer
+from .manifest import fingerprint, generator_fingerprint
+from .model import env_var_to_service_name, SERVICE_HOST_SUFFIX
+
+# architecture diagrams are built in two steps
+#   1. a DiagramModel is built from config_main.yaml: the cluster tree, a node per service with its icon, and the edges
+#   2. the model is rendered, either with the diagrams package, which runs graphviz,
+#      or by writing the graphviz dot source directly, see render_with_dot
+# large architectures can be split into an overview and a diagram per top level cluster, see split_diagram_model,
+# which are rendered in parallel, see render_diagrams
+# graphviz layout is the slow part, so rendered images are cached by a fingerprint of the model, see DiagramCache
+
+# icon of each kind of node, as the diagrams class that draws it
+#   custom icons are given as 'custom:<image file>'
+KAFKA = 'diagrams.onprem.queue.Kafka'
+DATABASE = 'diagrams.programming.flowchart.Database'
+ELASTICSEARCH = 'diagrams.elastic.elasticsearch.Elasticsearch'
+LOGSTASH = 'diagrams.elastic.elasticsearch.Logstash'
+REACT = 'diagrams.programming.framework.React'
+DJANGO = 'diagrams.programming.framework.Django'
+NGINX = 'diagrams.onprem.network.Nginx'
+EMAIL = 'diagrams.aws.engagement.SimpleEmailServiceSesEmail'
+DOCUMENTS = 'diagrams.programming.flowchart.MultipleDocuments'
+SERVER = 'diagrams.onprem.compute.Server'
+USERS = 'diagrams.onprem.client.Users'
+INTERNET = 'diagrams.onprem.network.Internet'
+REDIS = 'diagrams.onprem.inmemory.Redis'
+HAPROXY = 'diagrams.onprem.network.Haproxy'
+DOCKER = 'diagrams.onprem.container.Docker'
+CHATBOT = 'custom:chatmascot.png'
+# top level clusters, collapsed into a single node in overview diagrams
+CATEGORY = 'diagrams.generic.place.Datacenter'
+
+# background colours of the clusters drawn by render_with_dot, alternating with their depth,
+# the same as the diagrams package's clusters
+CLUSTER_COLOURS = ('#E5F5FD', '#EBF3E7', '#ECE8F6', '#FDF7E3')
+
+
+# ordered rules picking the icon of each service: the first rule with a substring found in
+# the service's lowercased name wins, and services matching no rule are drawn as DOCKER
+ICON_RULES = [
+    (('kafka',), KAFKA),
+    (('-db',), DATABASE),
+    (('-es-',), ELASTICSEARCH),
+    (('logs-monitoring',), LOGSTASH),
+    (('ui-view',), REACT),
+    (('react',), REACT),
+    (('app-',), DJANGO),
+    (('web-server',), NGINX),
+    (('placeholder-email',), EMAIL),
+    (('placeholder-dms',), DOCUMENTS),
+    (('placeholder-api', 'placeholder-eden'), SERVER),
+    (('placeholder-user',), USERS),
+    (('placeholder-internet', 'website'), INTERNET),
+    (('redis',), REDIS),
+    (('haproxy',), HAPROXY),
+    (('chatbot-main',), CHATBOT),
+]
+
+
+class IconRules:
+    # an ordered, extensible table of icon rules, matched with a single compiled regex
+    #
+    #   icon_rules = IconRules()
+    #   icon_rules.add(['payments', 'billing'], 'diagrams.onprem.compute.Server')
+    #   icon_rules.icon('webapp-payments')
+    #
+    # the rules are compiled into one alternation of lookaheads anchored at the start of the name,
+    #   ^(?:(?=.*?kafka)(?P<r0>)|(?=.*?\-db)(?P<r1>)|...)
+    # the regex engine tries the alternatives in order, so the first matching rule wins, as in the
+    # table, whatever the position of its substring in the name. icons are memoized per name
+    def __init__(self, rules=ICON_RULES, default=DOCKER):
+        self.rules = [(tuple(substrings), icon) for substrings, icon in rules]
+        self.default = default
+        self._matcher = None
+        self._icons = {}
+
+    def add(self, substrings, icon, first=True):
+        # adds a rule, by default ahead of the existing ones, so it takes priority over them
+        #   icon is a diagrams class, e.g. 'diagrams.onprem.compute.Server', or 'custom:<image file>'
+        if isinstance(substrings, str):
+            substrings = (substrings,)
+        rule = (tuple(substring.lower() for substring in substrings), icon)
+        if first:
+            self.rules.insert(0, rule)
+        else:
+            self.rules.append(rule)
+        self._matcher = None
+        self._icons = {}
+
+    def _compile(self):
+        alternatives = []
+        for index, (substrings, icon) in enumerate(self.rules):
+            lookaheads = '|'.join('(?=.*?' + re.escape(substring) + ')' for substring in substrings)
+            alternatives.append('(?:' + lookaheads + ')(?P<r%d>)' % index)
+        if not alternatives:
+            # matches nothing
+            return re.compile(r'(?!)')
+        return re.compile('^(?:' + '|'.join(alternatives) + ')', re.DOTALL)
+
+    def icon(self, service_name):
+        icon = self._icons.get(service_name)
+        if icon is None:
+            if self._matcher is None:
+                self._matcher = self._compile()
+            match = self._matcher.match(service_name.lower())
+            icon = self.rules[int(match.lastgroup[1:])][1] if match else self.default
+            self._icons[service_name] = icon
+        return icon
+
+
+# used when no rules are given
+default_icon_rules = IconRules()
+
+
+def service_icon(service_name):
+    return default_icon_rules.icon(service_name)
+
+
+class DiagramModel:
+    # everything that determines the rendered diagram, independently of the diagrams package
+    #   nodes: (service name, label, icon), in the order they are drawn
+    #   clusters: tree of {'name', 'nodes': [node index], 'clusters': [...]}
+    #   edges: (node index, node index, label or None)
+    #   top_nodes: [node index] of the nodes drawn outside any cluster
+    #   file_name: of the rendered diagram, without extension, by default named after the diagram, as the diagrams package does
+    def __init__(self, name, direction='TB', file_name=None):
+        self.name = name
+        self.direction = direction
+        self.nodes = []
+        self.clusters = []
+        self.edges = []
+        self.top_nodes = []
+        self._file_name = file_name
+
+    def to_dict(self):
+        return {'name': self.name, 'direction': self.direction, 'nodes': self.nodes, 'clusters': self.clusters, 'edges': self.edges,
+                'top_nodes': self.top_nodes, 'file_name': self.file_name}
+
+    def fingerprint(self, *options):
+        # also covers the package's own code, so a new version never reuses an image drawn by an older one
+        return fingerprint(generator_fingerprint(), self.to_dict(), options)
+
+    @property
+    def file_name(self):
+        if self._file_name is not None:
+            return self._file_name
+        # as named by the diagrams package
+        return self.name.replace(' ', '_').lower()
+
+
+def build_diagram_model(prefix, services, service_index, show_ports=False, tracer=None, icon_rules=None, environment=None):
+    # environment: one of the environments of config_main.yaml, to draw the diagram of that environment,
+    #   with each edge labelled with the host (and port) the service reaches the other one at there
+    if tracer is None:
+        tracer = NullTracer()
+    if icon_rules is None:
+        icon_rules = default_icon_rules
+    if environment is not None:
+        environment_context = EnvironmentContext(environment)
+        model = DiagramModel(prefix + ' Architecture ' + environment_context.name, direction='TB')
+    else:
+        environment_context = None
+        model = DiagramModel(prefix + ' Architecture', direction='TB')
+
+    # function to clean service name for display in diagram
+    # some names are too long and not necc in diagram
+    def clean_service_name(service_name):
+        return service_name.replace(prefix.lower() + '-','').replace('placeholder-','').replace('external-structured-','').replace('app-','')
+
+    # nested function to populate diagram clusters
+    #   service name -> index of its node, the last one drawn if a service is in several clusters
+    def populate_clusters(architecture, categories, clusters):
+        for category in categories.values():
+            cluster = {'name': category['name'], 'nodes': [], 'clusters': []}
+            clusters.append(cluster)
+            for service_name in category['services']:
+                architecture[service_name] = len(model.nodes)
+                cluster['nodes'].append(len(model.nodes))
+                model.nodes.append((service_name, clean_service_name(service_name), icon_rules.icon(service_name)))
+            populate_clusters(architecture, category['categories'], cluster['clusters'])
+        return architecture
+
+    with tracer.phase('diagram_categories'):
+        # first loop is to gather the categories each service is in, in a tree of categories keyed by name
+        categories = build_category_tree(services)
+
+    # second loop is to set out each cluster (included nested ones), and nodes inside
+    with tracer.phase('diagram_nodes'):
+        architecture = populate_clusters({}, categories, model.clusters)
+
+    with tracer.phase('diagram_edges'):
+        # third loop is to use service linkages via environment variables to connect the services
+        for service in services:
+            for container in service.containers:
+                for environment_variable in container.environment_variables:
+                    service_name = env_var_to_service_name(environment_variable.name, SERVICE_HOST_SUFFIX)
+                    if service_name in architecture:
+                        service_port = service_index.main_port(service_name)
+                        label = None
+                        if environment_context is not None:
+                            label = environment_address(environment_context, environment_variable.name, service_port)
+                        elif service_port is not None and show_ports:
+                            label = str(service_port)
+                        model.edges.append((architecture[service.name], architecture[service_name], label))
+
+                        # TODO add data flows
+    return model
+
+
+def build_category_tree(services):
+    # the nested architecture_categories of each service, as a tree keyed by category name
+    #   {'Default': {'name': 'Default', 'services': [...], 'categories': {}}, name: {...}, ...}
+    # each entry of a service's architecture_categories starts a path of categories, nested to any depth,
+    #   the service is drawn in the last category of each of its paths,
+    #   and services without architecture_categories in the Default category.
+    # categories and services keep the order they're first found in, and the tree is built in a single
+    # pass, each category entry being looked up once in its parent's dict
+    categories = {'Default': {'name': 'Default', 'services': [], 'categories': {}}}
+    for service in services:
+        service_name = service.name
+        # a stack of (parent categories, category entry) still to walk, reversed so paths are walked in the order they're listed in
+        paths = [(categories, service_category) for service_category in reversed(service.architecture_categories or [])]
+        if not paths:
+            categories['Default']['services'].append(service_name)
+        # categories the service has already been added to, in case two of its paths end in the same category
+        added = set()
+        while paths:
+            parents, service_category = paths.pop()
+            name = service_category['name']
+            category = parents.get(name)
+            if category is None:
+                category = parents[name] = {'name': name, 'services': [], 'categories': {}}
+            if service_category.get('architecture_categories'):
+                paths.extend((category['categories'], nested) for nested in reversed(service_category['architecture_categories']))
+            elif id(category) not in added:
+                added.add(id(category))
+                category['services'].append(service_name)
+    return categories
+
+
+def environment_address(environment_context, env_var_name, service_port):
+    # host[:port] a service reaches another one at in an environment, as resolved for its docker run script:
+    #   the environment's own value of the SERVICE_HOST variable, otherwise its default_host
+    #   None for environments with neither
+    if environment_context.overrides(env_var_name):
+        host = environment_context.values[environment_context.positions[env_var_name][-1]][1]
+    elif environment_context.has_default_host:
+        host = environment_context.default_host
+    else:
+        return None
+    return host if service_port is None else host + ':' + str(service_port)
+
+
+def cluster_node_indexes(cluster):
+    # indexes of the nodes in a cluster and its nested clusters
+    indexes = list(cluster['nodes'])
+    for nested_cluster in cluster['clusters']:
+        indexes.extend(cluster_node_indexes(nested_cluster))
+    return indexes
+
+
+def split_diagram_model(model):
+    # splits a model into an overview, with each top level cluster collapsed into a single node,
+    # and a diagram of each top level cluster, in that order
+    #   edges to services in other top level clusters are drawn to stubs of those services, grouped in a cluster
+    #   per top level cluster, so each diagram is self-contained and is laid out on its own. empty clusters are left out
+    clusters = []
+    top_cluster = {} # node index -> index of its top level cluster in clusters
+    for cluster in model.clusters:
+        node_indexes = cluster_node_indexes(cluster)
+        if node_indexes:
+            for node_index in node_indexes:
+                top_cluster[node_index] = len(clusters)
+            clusters.append((cluster, node_indexes))
+
+    overview = DiagramModel(model.name + ' Overview', model.direction, file_name=model.file_name + '_overview')
+    for cluster, node_indexes in clusters:
+        number_of_services = len(set(model.nodes[node_index][0] for node_index in node_indexes))
+        overview.top_nodes.append(len(overview.nodes))
+        overview.nodes.append((cluster['name'], '%s\n%d service%s' % (cluster['name'], number_of_services, '' if number_of_services == 1 else 's'), CATEGORY))
+    # one edge per pair of linked clusters, edges being drawn without arrows
+    links = {}
+    for node_from, node_to, label in model.edges:
+        link = (top_cluster[node_from], top_cluster[node_to])
+        if link[0] != link[1] and link not in links and link[::-1] not in links:
+            links[link] = None
+    overview.edges = [(cluster_from, cluster_to, None) for cluster_from, cluster_to in links]
+    models = [overview]
+
+    file_names = {overview.file_name}
+    for cluster_index, (cluster, node_indexes) in enumerate(clusters):
+        file_name = model.file_name + '_' + (re.sub(r'[^0-9a-z]+', '_', cluster['name'].lower()).strip('_') or str(cluster_index))
+        while file_name in file_names:
+            file_name += '_'
+        file_names.add(file_name)
+        part = DiagramModel(model.name + ' - ' + cluster['name'], model.direction, file_name=file_name)
+        # node index in model -> node index in part
+        part_indexes = {}
+        part.clusters.append(copy_cluster(model, part, cluster, part_indexes))
+        stub_clusters = {}
+        for node_from, node_to, label in model.edges:
+            if top_cluster[node_from] != cluster_index and top_cluster[node_to] != cluster_index:
+                continue
+            for node_index in (node_from, node_to):
+                if node_index not in part_indexes:
+                    other_cluster_index = top_cluster[node_index]
+                    if other_cluster_index not in stub_clusters:
+                        stub_clusters[other_cluster_index] = {'name': clusters[other_cluster_index][0]['name'] + ' (other diagram)', 'nodes': [], 'clusters': []}
+                        part.clusters.append(stub_clusters[other_cluster_index])
+                    part_indexes[node_index] = len(part.nodes)
+                    stub_clusters[other_cluster_index]['nodes'].append(len(part.nodes))
+                    part.nodes.append(model.nodes[node_index])
+            part.edges.append((part_indexes[node_from], part_indexes[node_to], label))
+        models.append(part)
+    return models
+
+
+def copy_cluster(model, part, cluster, part_indexes):
+    # copies a cluster of model, and its nodes, to part
+    part_cluster = {'name': cluster['name'], 'nodes': [], 'clusters': []}
+    for node_index in cluster['nodes']:
+        part_indexes[node_index] = len(part.nodes)
+        part_cluster['nodes'].append(len(part.nodes))
+        part.nodes.append(model.nodes[node_index])
+    for nested_cluster in cluster['clusters']:
+        part_cluster['clusters'].append(copy_cluster(model, part, nested_cluster, part_indexes))
+    return part_cluster
+
+
+def icon_class(icon):
+    # the diagrams class drawing an icon, and the extra arguments it needs
+    #   imported here, as importing diagrams is slow
+    if icon.startswith('custom:'):
+        from diagrams.custom import Custom
+        return Custom, (icon[len('custom:'):],)
+    import importlib
+    module_name, class_name = icon.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name), ()
+
+
+def render_with_diagrams(model, show=True, outformat='png'):
+    # draws the model with the diagrams package, which renders it with graphviz when the Diagram block exits
+    #   returns the name of the image file
+    from diagrams import Diagram, Edge, Cluster
+
+    def add_node(nodes, node_index):
+        service_name, label, icon = model.nodes[node_index]
+        node_class, args = icon_class(icon)
+        nodes[node_index] = node_class(label, *args)
+
+    def populate_clusters(nodes, clusters):
+        for cluster in clusters:
+            with Cluster(cluster['name']):
+                for node_index in cluster['nodes']:
+                    add_node(nodes, node_index)
+                populate_clusters(nodes, cluster['clusters'])
+
+    with Diagram(model.name, filename=model.file_name, show=show, direction=model.direction, outformat=outformat):
+        nodes = {}
+        for node_index in model.top_nodes:
+            add_node(nodes, node_index)
+        populate_clusters(nodes, model.clusters)
+        for node_from, node_to, label in model.edges:
+            if label is not None:
+                nodes[node_from] - Edge(label=label) - nodes[node_to]
+            else:
+                nodes[node_from] - Edge() - nodes[node_to]
+    return model.file_name + '.' + outformat
+
+
+def node_attributes(icon, label):
+    # dot attributes of a node, as set by the diagrams package for the icon's class
+    node_class, args = icon_class(icon)
+    if icon.startswith('custom:'):
+        image = args[0]
+    elif node_class._icon:
+        # resolved as in diagrams.Node._load_icon, relative to the folder the diagrams package is installed in
+        import diagrams
+        image = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(diagrams.__file__))), node_class._icon_dir, node_class._icon)
+    else:
+        return {}
+    # the diagrams package makes nodes taller for each line of the label
+    return {'shape': 'none', 'height': str(node_class._height + 0.4 * label.count('\n')), 'image': image}
+
+
+def emit_dot(model):
+    # the graphviz source of the model, with the same attributes as the diagrams package would set
+    #   built as plain graphviz statements, without a diagrams object per node and edge.
+    #   node ids are the node indices, rather than random ids, so the source is the same on every run
+    from diagrams import Diagram, Cluster, Edge
+    from graphviz import Digraph
+
+    dot = Digraph(model.name, filename=model.file_name)
+    dot.graph_attr.update(Diagram._default_graph_attrs)
+    dot.graph_attr['label'] = model.name
+    dot.node_attr.update(Diagram._default_node_attrs)
+    dot.edge_attr.update(Diagram._default_edge_attrs)
+    dot.graph_attr['rankdir'] = model.direction
+    dot.graph_attr['splines'] = 'ortho'
+
+    node_attributes_by_icon = {}
+
+    def emit_node(graph, node_index):
+        service_name, label, icon = model.nodes[node_index]
+        key = (icon, label.count('\n'))
+        if key not in node_attributes_by_icon:
+            node_attributes_by_icon[key] = node_attributes(icon, label)
+        graph.node('n%d' % node_index, label=label, **node_attributes_by_icon[key])
+
+    def emit_clusters(parent, clusters, depth):
+        for cluster in clusters:
+            subgraph = Digraph('cluster_' + cluster['name'])
+            subgraph.graph_attr.update(Cluster._default_graph_attrs)
+            subgraph.graph_attr['label'] = cluster['name']
+            subgraph.graph_attr['rankdir'] = 'LR'
+            subgraph.graph_attr['bgcolor'] = CLUSTER_COLOURS[depth % len(CLUSTER_COLOURS)]
+            for node_index in cluster['nodes']:
+                emit_node(subgraph, node_index)
+            emit_clusters(subgraph, cluster['clusters'], depth + 1)
+            parent.subgraph(subgraph)
+
+    for node_index in model.top_nodes:
+        emit_node(dot, node_index)
+    emit_clusters(dot, model.clusters, 0)
+    for node_from, node_to, label in model.edges:
+        edge_attributes = dict(Edge._default_edge_attrs)
+        if label:
+            edge_attributes['label'] = label
+        # the diagrams package draws a - b as an edge without arrows
+        edge_attributes['dir'] = 'none'
+        dot.edge('n%d' % node_from, 'n%d' % node_to, **edge_attributes)
+    return dot
+
+
+def render_with_dot(model, outformat='png'):
+    # writes the model's graphviz source to <file name>.dot and, unless outformat is 'dot',
+    # renders it with a single run of graphviz's dot command. never opens a viewer
+    #   returns the name of the image file, or of the .dot file
+    dot_file_name = model.file_name + '.dot'
+    with open(dot_file_name, 'w') as f:
+        f.write(emit_dot(model).source)
+    if outformat == 'dot':
+        return dot_file_name
+    if shutil.which('dot') is None:
+        raise RuntimeError('graphviz\'s dot command was not found, install graphviz or render with renderer=\'diagrams\', '
+                           'the graphviz source was written to %s' % dot_file_name)
+    file_name = model.file_name + '.' + outformat
+    subprocess.run(['dot', '-T' + outformat, '-o', file_name, dot_file_name], check=True)
+    return file_name
+
+
+def render_model(model, renderer='diagrams', outformat='png'):
+    # renders a model without opening a viewer, returns the name of the image file
+    if renderer == 'dot':
+        return render_with_dot(model, outformat=outformat)
+    return render_with_diagrams(model, show=False, outformat=outformat)
+
+
+def _render_model_task(task):
+    return render_model(*task)
+
+
+def render_diagrams(models, renderer='diagrams', outformat='png', cache=None, force_refresh=False, workers=None, tracer=None):
+    # renders models, in a pool of worker processes if workers > 1, as graphviz lays out each diagram in a single thread
+    #   images found in cache are reused, unless force_refresh, and new ones are added to it
+    #   returns the names of the image files, in the order of models
+    if tracer is None:
+        tracer = NullTracer()
+    file_names = []
+    pending = [] # (position in file_names, model, cache key)
+    for model in models:
+        file_name = model.file_name + '.' + outformat
+        key = model.fingerprint(renderer, outformat)
+        if cache is not None and not force_refresh:
+            with tracer.phase('diagram_cache'):
+                cached = cache.get(key, outformat, file_name)
+            if cached:
+                file_names.append(file_name)
+                continue
+        pending.append((len(file_names), model, key))
+        file_names.append(None)
+    if not pending:
+        return file_names
+
+    tasks = [(model, renderer, outformat) for _, model, _ in pending]
+    with tracer.phase('diagram_render'):
+        if workers and workers > 1 and len(tasks) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_render_model_task, tasks))
+        else:
+            results = [render_model(*task) for task in tasks]
+    for (position, model, key), file_name in zip(pending, results):
+        file_names[position] = file_name
+        if cache is not None and os.path.exists(file_name):
+            with tracer.phase('diagram_cache'):
+                cache.put(key, outformat, file_name)
+    return file_names
+
+
+def view_diagram(file_name):
+    # opens an image in the system's viewer, as the diagrams package does when show=True
+    import graphviz
+    graphviz.view(file_name)
+
+
+class DiagramCache:
+    # rendered diagrams, stored in a folder as <model fingerprint>.<format>
+    #   entries are evicted when older than max_age_seconds, or, oldest first, once the folder holds more than max_bytes
+    #   using an entry counts as a new write, so frequently used diagrams are kept
+    def __init__(self, folder, max_bytes=100 * 2 ** 20, max_age_seconds=30 * 24 * 3600):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+    def path(self, key, outformat):
+        return os.path.join(self.folder, key + '.' + outformat)
+
+    def get(self, key, outformat, file_name):
+        # copies a cached diagram to file_name, returns whether there was one
+        path = self.path(key, outformat)
+        if not os.path.exists(path):
+            return False
+        if self.max_age_seconds is not None and time.time() - os.path.getmtime(path) > self.max_age_seconds:
+            return False
+        shutil.copyfile(path, file_name)
+        os.utime(path)
+        return True
+
+    def put(self, key, outformat, file_name):
+        os.makedirs(self.folder, exist_ok=True)
+        # copied under a temporary name first, so other processes never read a partial image
+        path = self.path(key, outformat)
+        temporary_path = path + '.%d.tmp' % os.getpid()
+        shutil.copyfile(file_name, temporary_path)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        if not os.path.isdir(self.folder):
+            return
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            if self.max_age_seconds is not None and now - stat.st_mtime > self.max_age_seconds:
+                os.remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        if self.max_bytes is not None:
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                os.remove(path)
+                total_bytes -= size
+
+    def clear(self):
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
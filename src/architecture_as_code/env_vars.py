@@ -0,0 +1,126 @@
+# kinds of environment-independent entries in a compiled plan
+VALUE = 0                # always written with the given value
+VALUE_UNLESS_GPU_OFF = 1 # written unless the service's GPU is switched off in this environment
+DEFAULT_HOST = 2         # environment's default_host, unless the environment sets the variable itself
+
+
+class EnvironmentContext:
+    # per-environment lookups, computed once per environment and shared by all services
+    def __init__(self, environment):
+        self.name = environment.name
+        self.name_lower = environment.name.lower()
+        self.has_default_host = environment.default_host is not None
+        self.default_host = str(environment.default_host) if self.has_default_host else None
+        environment_variables = environment.environment_variables
+        self.values = [(env_var.name, str(env_var.value)) for env_var in environment_variables]
+        # env var name -> positions in the environment's list, which sets the output order
+        self.positions = {}
+        for position, env_var in enumerate(environment_variables):
+            self.positions.setdefault(env_var.name, []).append(position)
+        self.universal_positions = [position for position, env_var in enumerate(environment_variables) if env_var.universal]
+
+    def overrides(self, name):
+        return name in self.positions
+
+
+class ContainerEnvPlan:
+    # a container's environment_variables compiled once, independently of any environment
+    #
+    # rendering for an environment then only needs dict lookups against its EnvironmentContext,
+    # instead of scanning the environment's variables for every container variable.
+    # the docker and k8s outputs resolve variables slightly differently, so the plan holds
+    # one list of entries for each, compiled from the same pass over the container
+    def __init__(self, container, proxy_ports, service_index):
+        self.docker_static = []
+        self.k8s_static = []
+        # env var name -> number of times an environment-specific value is written for it
+        self.docker_env_weights = {}
+        self.k8s_env_weights = {}
+
+        for environment_variable in container.environment_variables:
+            name = environment_variable.name
+            name_lower = name.lower()
+            service_port = None
+            if 'SERVICE_PORT' in name:
+                service_port = service_index.port_for_env_var(name)
+                if service_port is not None:
+                    service_port = str(service_port)
+
+            # docker: container variables that apply across all environments
+            if environment_variable.value is not None and 'placeholder' not in name_lower:
+                kind = VALUE_UNLESS_GPU_OFF if name == 'USE_GPU' else VALUE
+                self.docker_static.append((kind, name, str(environment_variable.value)))
+            # if proxy port, populate with proxy value
+            elif 'PROXY_PORT' in name:
+                if name in proxy_ports:
+                    self.docker_static.append((VALUE, name, str(proxy_ports[name])))
+            # use default value for hosts, they tend to be the same for single-server deployments
+            #   environments without a default_host fall through to the service port lookup
+            elif 'host' in name_lower and 'placeholder' not in name_lower:
+                self.docker_static.append((DEFAULT_HOST, name, service_port))
+            # try to populate service port
+            elif service_port is not None:
+                self.docker_static.append((VALUE, name, service_port))
+
+            # k8s: container variables that apply across all environments
+            if environment_variable.value is not None:
+                kind = VALUE_UNLESS_GPU_OFF if name == 'USE_GPU' else VALUE
+                self.k8s_static.append((kind, name, str(environment_variable.value)))
+            # for k8s, ignore env vars ending with SERVICE_HOST, as those are managed by k8s separately
+            elif 'host' in name_lower and not name.endswith('SERVICE_HOST') and not name.endswith('SERVICE_PORT'):
+                self.k8s_static.append((DEFAULT_HOST, name, None))
+            # service ports are only included when flagged with include_in_k8
+            if service_port is not None and environment_variable.include_in_k8:
+                self.k8s_static.append((VALUE, name, service_port))
+
+            # environment-specific values, which can include overrides of general variables
+            self.docker_env_weights[name] = self.docker_env_weights.get(name, 0) + 1
+            k8s_weight = 0
+            if not name.endswith('SERVICE_HOST') and 'placeholder' not in name:
+                k8s_weight += 1
+            # however, include the env vars where the flag include_in_k8 is present, e.g. databases and other external dependencies
+            if environment_variable.include_in_k8:
+                k8s_weight += 1
+            if k8s_weight:
+                self.k8s_env_weights[name] = self.k8s_env_weights.get(name, 0) + k8s_weight
+
+    def _render(self, static, env_weights, environment_context, gpu_off):
+        rendered = []
+        for kind, name, value in static:
+            if kind == VALUE:
+                rendered.append((name, value))
+            elif kind == VALUE_UNLESS_GPU_OFF:
+                if not gpu_off:
+                    rendered.append((name, value))
+            elif environment_context.has_default_host:
+                if not environment_context.overrides(name):
+                    rendered.append((name, environment_context.default_host))
+            elif value is not None:
+                rendered.append((name, value))
+
+        # environment-specific and universal variables, in the environment's order
+        #   at the same position, a container's own variables come before the universal copy
+        ordered = []
+        for name, weight in env_weights.items():
+            for position in environment_context.positions.get(name, ()):
+                ordered.extend([(position, 0)] * weight)
+        ordered.extend((position, 1) for position in environment_context.universal_positions)
+        ordered.sort()
+        rendered.extend(environment_context.values[position] for position, _ in ordered)
+        return rendered
+
+    def docker_env(self, environment_context, gpu_off):
+        # (name, value) pairs for the docker run script
+        return self._render(self.docker_static, self.docker_env_weights, environment_context, gpu_off)
+
+    def k8s_env(self, environment_context, gpu_off):
+        # (name, value) pairs for the k8s deployment
+        return self._render(self.k8s_static, self.k8s_env_weights, environment_context, gpu_off)
+
+
+def compile_env_var_plans(services, proxy_ports, service_index):
+    # service name -> one ContainerEnvPlan per container, shared by all environments
+    return {
+        service.name: [ContainerEnvPlan(container, proxy_ports, service_index) for container in service.containers]
+        for service in services
+    }
@@ -0,0 +1,158 @@
+import json, sys, time
+
+# tracers collect where the time goes in a run of __call__ or generate_architecture_diagram
+#
+#   aac = ArchitectureAsCode('WEBAPP', tracer=Tracer())
+#   aac(config_main_file_name='config_main.yaml')
+#   aac.tracer.dump('trace.json')
+#
+# the default NullTracer does nothing, so runs that aren't traced only pay for a few method calls.
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class NullTracer:
+    enabled = False
+
+    def phase(self, name):
+        return _null_phase
+
+    def start(self, name):
+        pass
+
+    def stop(self, name):
+        pass
+
+    def add_time(self, name, seconds, calls=1):
+        pass
+
+    def record_service(self, environment_name, service_name, seconds, files_written=0, bytes_written=0, skipped=False):
+        pass
+
+    def record_files(self, files_written, bytes_written):
+        pass
+
+
+class _Phase:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.tracer.start(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.stop(self.name)
+        return False
+
+
+class Tracer(NullTracer):
+    # records, for each phase, its wall time and the number of times it ran, as well as the time
+    # spent on each service and the files and bytes written
+    #   trace_memory: also record the peak memory allocated by python in each phase, using tracemalloc.
+    #                 this slows the run down, and only covers this process, not worker processes
+    #   callback: called as callback(event, details) when a phase ends and when a service is rendered,
+    #             e.g. to feed a progress bar or an external tracing system
+    enabled = True
+
+    def __init__(self, trace_memory=False, callback=None):
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.phases = {}
+        self.services = []
+        self.files_written = 0
+        self.bytes_written = 0
+        self.peak_memory_bytes = None
+        self._started = {}
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def phase(self, name):
+        # with tracer.phase('load_config'): ...
+        return _Phase(self, name)
+
+    def start(self, name):
+        # for phases that don't fit a with block, e.g. the diagram being rendered when its with block exits
+        if self.trace_memory:
+            import tracemalloc
+            # reset_peak is only available from python 3.9, before that the peak covers the run so far
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        self._started[name] = time.perf_counter()
+
+    def stop(self, name):
+        # stopping a phase that wasn't started does nothing
+        started = self._started.pop(name, None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        self.add_time(name, seconds)
+        if self.trace_memory:
+            import tracemalloc
+            peak = tracemalloc.get_traced_memory()[1]
+            phase = self.phases[name]
+            phase['peak_memory_bytes'] = max(phase.get('peak_memory_bytes', 0), peak)
+            self.peak_memory_bytes = max(self.peak_memory_bytes or 0, peak)
+        if self.callback is not None:
+            self.callback('phase', {'name': name, 'seconds': seconds})
+
+    def add_time(self, name, seconds, calls=1):
+        # adds time measured elsewhere, e.g. in worker processes, to a phase
+        phase = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        phase['seconds'] += seconds
+        phase['calls'] += calls
+
+    def record_service(self, environment_name, service_name, seconds, files_written=0, bytes_written=0, skipped=False):
+        service = {'environment': environment_name, 'service': service_name, 'seconds': seconds,
+                   'files_written': files_written, 'bytes_written': bytes_written, 'skipped': skipped}
+        self.services.append(service)
+        if self.callback is not None:
+            self.callback('service', service)
+
+    def record_files(self, files_written, bytes_written):
+        self.files_written += files_written
+        self.bytes_written += bytes_written
+
+    def slowest_services(self, count=10):
+        return sorted(self.services, key=lambda service: service['seconds'], reverse=True)[:count]
+
+    def to_dict(self):
+        return {
+            'phases': self.phases,
+            'services': self.services,
+            'files_written': self.files_written,
+            'bytes_written': self.bytes_written,
+            'peak_memory_bytes': self.peak_memory_bytes,
+            'max_rss_bytes': max_rss_bytes(),
+        }
+
+    def dump(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def __repr__(self):
+        phases = ', '.join('%s %.3fs' % (name, phase['seconds']) for name, phase in self.phases.items())
+        return 'Tracer(%s; %d files, %d bytes written)' % (phases, self.files_written, self.bytes_written)
+
+
+def max_rss_bytes():
+    # peak resident memory of this process, or None where the resource module isn't available (windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
@@ -0,0 +1,291 @@
+import os
+
+from .manifest import MANIFEST_FILE_NAME, content_hash, fingerprint, load_manifest, new_manifest, save_manifest
+
+# kustomize layout of the k8s files: one base shared by all environments, and an overlay per environment
+#
+#   deployment_files/kustomize/base/kustomization.yaml, k8s-<service>.yaml ...
+#   deployment_files/kustomize/overlays/<environment>/kustomization.yaml, patches and resources
+#
+# the documents of each service are rendered in full once, for the first environment, and for each other environment
+# only the parts that depend on it are built on a copy of them: images, env values and volumes, see
+# RenderJob.environment_k8s_documents, the other documents being shared. they are then compared with each other
+#   base: the documents found in all environments, as in the first environment, with the image registries
+#         left out of their images, so the overlays set them with kustomize's images transformer
+#   overlays: the base, the images of the environment, a JSON6902 patch for each document that differs
+#             from the base, and the documents only found in some environments (e.g. persistent volume claims),
+#             as resources of their own
+# kustomize build overlays/<environment> gives the same documents as the environment's k8s files
+# the folder has a manifest, as the environment folders do, so a run in which no service changed in any environment
+# leaves it as it is
+#
+#   kubectl apply -k deployment_files/kustomize/overlays/prod
+
+KUSTOMIZE_FOLDER = 'kustomize'
+
+
+def json_patch(source, target, path=''):
+    # JSON6902 operations turning source into target
+    #   documents shared between environments are the same objects, and aren't compared
+    #   other lists are patched item by item, then extended or shortened at the end
+    if source is target:
+        return []
+    if isinstance(source, dict) and isinstance(target, dict):
+        operations = []
+        for key in source:
+            if key not in target:
+                operations.append({'op': 'remove', 'path': path + '/' + json_pointer_token(key)})
+        for key in target:
+            if key in source:
+                operations.extend(json_patch(source[key], target[key], path + '/' + json_pointer_token(key)))
+            else:
+                operations.append({'op': 'add', 'path': path + '/' + json_pointer_token(key), 'value': target[key]})
+        return operations
+    if isinstance(source, list) and isinstance(target, list):
+        if named_items(source) and named_items(target):
+            return json_patch_named(source, target, path)
+        operations = []
+        for index in range(min(len(source), len(target))):
+            operations.extend(json_patch(source[index], target[index], path + '/' + str(index)))
+        for index in range(len(source) - 1, len(target) - 1, -1):
+            operations.append({'op': 'remove', 'path': path + '/' + str(index)})
+        for index in range(len(source), len(target)):
+            operations.append({'op': 'add', 'path': path + '/' + str(index), 'value': target[index]})
+        return operations
+    # True == 1 in python, but not in json
+    if source != target or isinstance(source, bool) != isinstance(target, bool):
+        return [{'op': 'replace', 'path': path, 'value': target}]
+    return []
+
+
+def named_items(items):
+    # lists of items with names, e.g. env vars or containers, are patched by name, see json_patch_named
+    return all(isinstance(item, dict) and 'name' in item for item in items)
+
+
+def json_patch_named(source, target, path):
+    # JSON6902 operations turning source into target, lists of named items, so an env var set in one environment
+    # only is one add, rather than a replace of each env var after it
+    #   the items kept are those of the longest common sequence of names, the others are removed, from the last,
+    #   then the items of target are added, or patched, in order
+    source_names = [item['name'] for item in source]
+    target_names = [item['name'] for item in target]
+    lengths = [[0] * (len(target_names) + 1) for _ in range(len(source_names) + 1)]
+    for i in range(len(source_names) - 1, -1, -1):
+        for j in range(len(target_names) - 1, -1, -1):
+            if source_names[i] == target_names[j]:
+                lengths[i][j] = lengths[i + 1][j + 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i + 1][j], lengths[i][j + 1])
+    kept = {}
+    i = j = 0
+    while i < len(source_names) and j < len(target_names):
+        if source_names[i] == target_names[j]:
+            kept[j] = i
+            i += 1
+            j += 1
+        elif lengths[i + 1][j] >= lengths[i][j + 1]:
+            i += 1
+        else:
+            j += 1
+    operations = []
+    kept_sources = set(kept.values())
+    for index in range(len(source) - 1, -1, -1):
+        if index not in kept_sources:
+            operations.append({'op': 'remove', 'path': path + '/' + str(index)})
+    for index in range(len(target)):
+        if index in kept:
+            operations.extend(json_patch(source[kept[index]], target[index], path + '/' + str(index)))
+        else:
+            operations.append({'op': 'add', 'path': path + '/' + str(index), 'value': target[index]})
+    return operations
+
+
+def json_pointer_token(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def split_image(image):
+    # 'registry:5000/webapp-django:1.2' -> ('registry:5000/webapp-django', 'webapp-django', ':1.2')
+    #   (name, name without the registry, tag or digest)
+    last = image.rsplit('/', 1)[-1]
+    for separator in ('@', ':'):
+        if separator in last:
+            tag = last[last.index(separator):]
+            return image[:len(image) - len(tag)], last[:len(last) - len(tag)], tag
+    return image, last, ''
+
+
+def deployment_containers(document):
+    if document.get('kind') != 'Deployment':
+        return []
+    try:
+        return document['spec']['template']['spec']['containers'] or []
+    except (KeyError, TypeError):
+        return []
+
+
+def document_key(document):
+    metadata = document.get('metadata') or {}
+    return document.get('kind'), metadata.get('name')
+
+
+def patch_target(document):
+    # target of a patch, e.g. {'group': 'apps', 'version': 'v1', 'kind': 'Deployment', 'name': 'webapp-django'}
+    group, _, version = document.get('apiVersion', '').rpartition('/')
+    target = {}
+    if group:
+        target['group'] = group
+    target['version'] = version
+    target['kind'] = document.get('kind')
+    target['name'] = (document.get('metadata') or {}).get('name')
+    return target
+
+
+def environment_documents(job):
+    # file name -> documents of the k8s files of each environment, in the order render_services writes them
+    #   each service is rendered in full for the first environment only, see RenderJob.environment_k8s_documents
+    per_environment = [{} for _ in job.environments]
+    if not per_environment:
+        return per_environment
+    for service in job.services:
+        if 'placeholder-' in service.name:
+            continue
+        base_files = {}
+        job.render_k8s_documents(0, service, base_files)
+        for environment_index, files in enumerate(per_environment):
+            service_files = base_files if environment_index == 0 else job.environment_k8s_documents(environment_index, service, base_files)
+            files.update((file_name, documents) for file_name, (documents, _) in service_files.items())
+    return per_environment
+
+
+def kustomize_fingerprint(job):
+    # hash of everything the kustomize folder depends on, the fingerprint of each service in each environment
+    return fingerprint([[environment.name, [[service.name, job.service_fingerprint(environment_index, service)] for service in job.services]]
+                        for environment_index, environment in enumerate(job.environments)])
+
+
+def kustomize_files(job):
+    # the files of the kustomize folder, as {relative path: text}
+    environment_names = [environment.name for environment in job.environments]
+    per_environment = environment_documents(job)
+
+    # images of the deployments: name without the registry -> name in each environment
+    #   names found with different registries in the same environment are left as they are, and patched
+    images = [{} for _ in environment_names]
+    conflicts = set()
+    for environment_images, files in zip(images, per_environment):
+        for documents in files.values():
+            for document in documents:
+                for container in deployment_containers(document):
+                    name, short_name, _ = split_image(str(container.get('image', '')))
+                    if environment_images.setdefault(short_name, name) != name:
+                        conflicts.add(short_name)
+    for files in per_environment:
+        for documents in files.values():
+            for document in documents:
+                for container in deployment_containers(document):
+                    name, short_name, tag = split_image(str(container.get('image', '')))
+                    if short_name not in conflicts:
+                        container['image'] = short_name + tag
+
+    # documents by file, in the order of the first environment to have each of them
+    file_names = []
+    for files in per_environment:
+        for file_name in files:
+            if file_name not in file_names:
+                file_names.append(file_name)
+
+    extension = job.k8s_file_extension
+    dump = job.backend.dump_k8s
+    output = {}
+    base_resources = []
+    overlays = [{'resources': [], 'patches': []} for _ in environment_names]
+    for file_name in file_names:
+        keys = []
+        by_key = [{} for _ in environment_names]
+        for environment_index, files in enumerate(per_environment):
+            for document in files.get(file_name, []):
+                key = document_key(document)
+                by_key[environment_index][key] = document
+                if key not in keys:
+                    keys.append(key)
+        base_documents = []
+        overlay_documents = [[] for _ in environment_names]
+        for key in keys:
+            if all(key in documents for documents in by_key):
+                base_document = by_key[0][key]
+                base_documents.append(base_document)
+                for environment_index, documents in enumerate(by_key):
+                    operations = json_patch(base_document, documents[key])
+                    if operations:
+                        patch_file_name = 'patch-' + '-'.join(str(part).lower() for part in key) + extension
+                        output['overlays/' + environment_names[environment_index] + '/' + patch_file_name] = dump([operations], job.k8s_format)
+                        overlays[environment_index]['patches'].append({'path': patch_file_name, 'target': patch_target(base_document)})
+            else:
+                for environment_index, documents in enumerate(by_key):
+                    if key in documents:
+                        overlay_documents[environment_index].append(documents[key])
+        if base_documents:
+            output['base/' + file_name] = dump(base_documents, job.k8s_format)
+            base_resources.append(file_name)
+        for environment_index, documents in enumerate(overlay_documents):
+            if documents:
+                output['overlays/' + environment_names[environment_index] + '/' + file_name] = dump(documents, job.k8s_format)
+                overlays[environment_index]['resources'].append(file_name)
+
+    output['base/kustomization.yaml'] = dump([kustomization(base_resources)], 'yaml')
+    for environment_index, environment_name in enumerate(environment_names):
+        overlay = overlays[environment_index]
+        environment_images = [{'name': short_name, 'newName': name} for short_name, name in sorted(images[environment_index].items())
+                              if short_name not in conflicts and name != short_name]
+        output['overlays/' + environment_name + '/kustomization.yaml'] = dump(
+            [kustomization(['../../base'] + overlay['resources'], environment_images, overlay['patches'])], 'yaml')
+    return output
+
+
+def kustomization(resources, images=None, patches=None):
+    document = {'apiVersion': 'kustomize.config.k8s.io/v1beta1', 'kind': 'Kustomization', 'resources': resources}
+    if images:
+        document['images'] = images
+    if patches:
+        document['patches'] = patches
+    return document
+
+
+def write_kustomize(job, folder):
+    # writes the kustomize folder, leaving files with unchanged content untouched, and deleting any other file in it
+    #   when incremental, and the fingerprint of the previous run is unchanged, nothing is rendered
+    #   the manifest's shared files hold the hash of each file, by relative path
+    #   returns the changes, as for an environment folder
+    from .render import remove_file, write_file
+    changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': [], 'skipped_services': []}
+    previous_manifest = load_manifest(folder) if job.incremental else None
+    previous_files = previous_manifest['shared'] if previous_manifest else {}
+    manifest = new_manifest()
+    manifest['fingerprint'] = kustomize_fingerprint(job)
+    if previous_manifest and previous_manifest.get('fingerprint') == manifest['fingerprint'] and \
+            all(os.path.exists(os.path.join(folder, *path.split('/'))) for path in previous_files):
+        changes['unchanged'].extend(previous_files)
+        changes['skipped_services'].extend(service.name for service in job.services)
+        return changes
+    files = kustomize_files(job)
+    for path, content in files.items():
+        file_path = os.path.join(folder, *path.split('/'))
+        manifest['shared'][path] = content_hash(content)
+        if previous_files.get(path) == manifest['shared'][path] and os.path.exists(file_path):
+            changes['unchanged'].append(path)
+            continue
+        changes['changed' if path in previous_files else 'added'].append(path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        write_file(os.path.dirname(file_path), os.path.basename(file_path), content)
+    for directory, _, file_names in os.walk(folder, topdown=False):
+        for file_name in file_names:
+            path = os.path.relpath(os.path.join(directory, file_name), folder).replace(os.sep, '/')
+            if path not in files and path != MANIFEST_FILE_NAME:
+                remove_file(directory, file_name)
+                changes['removed'].append(path)
+        if directory != folder and not os.listdir(directory):
+            os.rmdir(directory)
+    save_manifest(folder, manifest)
+    return changes
@@ -0,0 +1,171 @@
+import shlex
+
+# launch.sh starts the docker containers of an environment in the order of their dependencies
+#
+#   ./deployment_files/prod/launch.sh
+#   WAIT=60 PULL_JOBS=8 ./deployment_files/prod/launch.sh
+#
+# a service depends on those its containers refer to with *_SERVICE_SERVICE_HOST environment variables, the links
+# drawn in the diagram. services are started in waves: the first wave holds the services depending on no other,
+# each later wave those whose dependencies were all started in earlier waves, and the services of a wave are
+# started concurrently. services depending on each other, directly or not, are reported as a dependency cycle,
+# and started together, in one wave
+#
+# the images are pulled first, each full image reference once, PULL_JOBS at a time
+
+
+def dependency_waves(dependencies):
+    # dependencies: service name -> names of the services it depends on, in config order
+    #   returns the waves, as lists of service names in config order, and the dependency cycles, as lists of
+    #   service names, with dependencies on services not in dependencies ignored
+    #   the strongly connected components of the graph are found with tarjan's algorithm, iteratively, so
+    #   large configs don't hit the recursion limit. a component is found after every component it depends on
+    order = {service_name: index for index, service_name in enumerate(dependencies)}
+    edges = {service_name: [dependency for dependency in service_dependencies if dependency in order and dependency != service_name]
+             for service_name, service_dependencies in dependencies.items()}
+    indexes = {}
+    low_links = {}
+    stack = []
+    on_stack = set()
+    components = []
+    component_of = {}
+    for root in dependencies:
+        if root in indexes:
+            continue
+        work = [(root, 0)]
+        while work:
+            service_name, edge_index = work.pop()
+            if edge_index == 0:
+                indexes[service_name] = low_links[service_name] = len(indexes)
+                stack.append(service_name)
+                on_stack.add(service_name)
+            recurse = False
+            for position in range(edge_index, len(edges[service_name])):
+                dependency = edges[service_name][position]
+                if dependency not in indexes:
+                    work.append((service_name, position + 1))
+                    work.append((dependency, 0))
+                    recurse = True
+                    break
+                if dependency in on_stack:
+                    low_links[service_name] = min(low_links[service_name], indexes[dependency])
+            if recurse:
+                continue
+            if low_links[service_name] == indexes[service_name]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component_of[member] = len(components)
+                    component.append(member)
+                    if member == service_name:
+                        break
+                components.append(sorted(component, key=order.get))
+            if work:
+                parent = work[-1][0]
+                low_links[parent] = min(low_links[parent], low_links[service_name])
+
+    # wave of each component: one after the latest wave of the components it depends on
+    component_waves = []
+    for component in components:
+        wave = 0
+        for member in component:
+            for dependency in edges[member]:
+                if component_of[dependency] != component_of[member]:
+                    wave = max(wave, component_waves[component_of[dependency]] + 1)
+        component_waves.append(wave)
+    waves = [[] for _ in range(max(component_waves) + 1)] if components else []
+    for service_name in dependencies:
+        waves[component_waves[component_of[service_name]]].append(service_name)
+    cycles = sorted((component for component in components if len(component) > 1), key=lambda component: order[component[0]])
+    return waves, cycles
+
+
+def launcher_script(environment_name, services, images_to_pull):
+    # launch.sh of an environment
+    #   services: (service name, its docker run scripts, the --name of its containers, names of the services it depends on),
+    #   in config order
+    #   images_to_pull: lists of (container name, docker pull line), as for pull_latest_images.sh
+    #   returns the script, and the dependency cycles
+    scripts = {}
+    container_names = {}
+    dependencies = {}
+    for service_name, run_scripts, service_container_names, service_dependencies in services:
+        if run_scripts:
+            # sorted, as the order of a service's files can differ between a manifest and a fresh render
+            scripts[service_name] = sorted(run_scripts)
+            container_names[service_name] = service_container_names
+            dependencies[service_name] = service_dependencies
+    waves, cycles = dependency_waves(dependencies)
+
+    images = []
+    for service_images in images_to_pull:
+        for _, pull_line in service_images:
+            image = pull_line.strip()[len('docker pull '):]
+            if image not in images:
+                images.append(image)
+
+    lines = [
+        '#!/usr/bin/env bash',
+        '# starts the docker containers of %s, in waves ordered by their *_SERVICE_SERVICE_HOST dependencies' % environment_name,
+        '#   PULL=0: don\'t pull the images first. PULL_JOBS: number of images pulled at a time (default 4)',
+        '#   WAIT=<seconds>: after starting each wave, wait up to this long for its containers to be running, or',
+        '#   healthy if they have a health check, before starting the next wave (default 0, don\'t wait)',
+    ]
+    if cycles:
+        lines.append('# dependency cycles, services depending on each other, directly or not, each started in one wave:')
+        lines.extend('#   ' + ', '.join(cycle) for cycle in cycles)
+    lines += [
+        'set -u',
+        'cd "$(dirname "$0")" || exit 1',
+        'PULL=${PULL:-1}',
+        'PULL_JOBS=${PULL_JOBS:-4}',
+        'WAIT=${WAIT:-0}',
+        '',
+        'start_wave() {',
+        '  local wave=$1 script pid failed=0',
+        '  local pids=()',
+        '  shift',
+        '  echo "wave $wave: $*"',
+        '  for script in "$@"; do',
+        '    bash "./$script" &',
+        '    pids+=($!)',
+        '  done',
+        '  for pid in "${pids[@]}"; do',
+        '    wait "$pid" || failed=1',
+        '  done',
+        '  return $failed',
+        '}',
+        '',
+        'wait_ready() {',
+        '  [ "$WAIT" -gt 0 ] || return 0',
+        '  local name status deadline=$((SECONDS + WAIT))',
+        '  for name in "$@"; do',
+        '    while :; do',
+        '      status=$(docker inspect -f \'{{if .State.Health}}{{.State.Health.Status}}{{else}}{{.State.Status}}{{end}}\' "$name" 2>/dev/null)',
+        '      if [ "$status" = running ] || [ "$status" = healthy ]; then',
+        '        break',
+        '      fi',
+        '      if [ "$SECONDS" -ge "$deadline" ]; then',
+        '        echo "$name not ready after ${WAIT}s: ${status:-not found}" >&2',
+        '        return 1',
+        '      fi',
+        '      sleep 1',
+        '    done',
+        '  done',
+        '}',
+        '',
+    ]
+    if images:
+        lines.append('if [ "$PULL" != 0 ]; then')
+        lines.append('  printf \'%s\\n\' \\')
+        lines.extend('    ' + shlex.quote(image) + ' \\' for image in images)
+        lines.append('  | xargs -P "$PULL_JOBS" -n 1 docker pull || exit 1')
+        lines.append('fi')
+        lines.append('')
+    for number, wave in enumerate(waves, start=1):
+        wave_scripts = [script for service_name in wave for script in scripts[service_name]]
+        lines.append('start_wave %d %s || exit 1' % (number, ' '.join(shlex.quote(script) for script in wave_scripts)))
+        wave_container_names = [container_name for service_name in wave for container_name in container_names[service_name]]
+        lines.append('wait_ready %s || exit 1' % ' '.join(shlex.quote(container_name) for container_name in wave_container_names))
+    return '\n'.join(lines) + '\n', cycles
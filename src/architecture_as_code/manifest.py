@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+
+# each environment folder keeps a manifest of what was generated into it, so later runs
+#   can skip services whose inputs haven't changed, leave unchanged files untouched and
+#   delete the files of services that were removed from config_main.yaml
+MANIFEST_FILE_NAME = '.aac-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def fingerprint(*parts):
+    # stable hash of any json-serialisable inputs, including ruamel's CommentedMap / CommentedSeq
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+_generator_fingerprint = None
+
+
+def generator_fingerprint():
+    # hash of the package's own code and templates
+    #   part of every service fingerprint, so upgrading the package re-renders everything
+    global _generator_fingerprint
+    if _generator_fingerprint is None:
+        package_path = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for folder in (package_path, os.path.join(package_path, 'templates')):
+            for file_name in sorted(os.listdir(folder)):
+                if file_name.endswith('.py') or file_name.endswith('.yaml'):
+                    digest.update(file_name.encode())
+                    with open(os.path.join(folder, file_name), 'rb') as f:
+                        digest.update(f.read())
+        _generator_fingerprint = digest.hexdigest()
+    return _generator_fingerprint
+
+
+def invalidate_generator_fingerprint():
+    # for long-lived processes, e.g. watch mode, where the templates can change underneath us
+    global _generator_fingerprint
+    _generator_fingerprint = None
+
+
+def new_manifest():
+    # services: service name -> {'fingerprint', 'files': {file name: content hash}, 'images': [[container name, pull line]]}
+    # shared: files written for the whole environment, e.g. pull_latest_images.sh
+    return {'version': MANIFEST_VERSION, 'services': {}, 'shared': {}}
+
+
+def load_manifest(env_path):
+    # returns None if there is no usable manifest, in which case the folder is regenerated from scratch
+    try:
+        with open(os.path.join(env_path, MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(env_path, manifest):
+    # returns the number of bytes written
+    content = json.dumps(manifest, indent=1, sort_keys=True)
+    with open(os.path.join(env_path, MANIFEST_FILE_NAME), 'w') as f:
+        f.write(content)
+    return len(content.encode())
+
+
+class GenerationReport:
+    # what a run did to each environment folder
+    #   added / changed / removed hold file names relative to the environment folder,
+    #   skipped_services the services that weren't re-rendered as their inputs hadn't changed
+    #   dependency_cycles the services depending on each other in launch.sh, see launcher.py
+    def __init__(self):
+        self.environments = {}
+
+    def environment(self, environment_name):
+        if environment_name not in self.environments:
+            self.environments[environment_name] = {'added': [], 'changed': [], 'removed': [], 'unchanged': [], 'skipped_services': [],
+                                                   'dependency_cycles': []}
+        return self.environments[environment_name]
+
+    def merge(self, environment_name, changes):
+        report = self.environment(environment_name)
+        for key, values in changes.items():
+            report[key].extend(values)
+
+    def to_dict(self):
+        return {name: {key: sorted(values) for key, values in report.items()} for name, report in self.environments.items()}
+
+    def __repr__(self):
+        summaries = []
+        for name, report in self.environments.items():
+            summary = '%s: %d added, %d changed, %d removed, %d unchanged' % (
+                name, len(report['added']), len(report['changed']), len(report['removed']), len(report['unchanged']))
+            if report['dependency_cycles']:
+                summary += ', dependency cycles: ' + ', '.join('(%s)' % ', '.join(cycle) for cycle in report['dependency_cycles'])
+            summaries.append(summary)
+        return 'GenerationReport(' + '; '.join(summaries) + ')'
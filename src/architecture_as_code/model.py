@@ -0,0 +1,179 @@
+import re
+from fnmatch import fnmatchcase
+
+from .manifest import fingerprint
+
+SERVICE_HOST_SUFFIX = '_SERVICE_SERVICE_HOST'
+SERVICE_PORT_SUFFIX = '_SERVICE_SERVICE_PORT'
+
+
+def docker_container_name(service_name, container_name, several_containers):
+    # --name of a container in its docker run script, e.g. webapp-worker, or webapp-worker-worker-sidecar for
+    # services with several containers, as docker container names must be unique
+    if not several_containers:
+        return service_name
+    return service_name + '-' + re.sub('[^a-zA-Z0-9_.-]', '-', container_name.split('/')[-1])
+
+
+def env_var_to_service_name(env_var_name, suffix):
+    # e.g. WEBAPP_DB_SERVICE_SERVICE_HOST -> webapp-db
+    return env_var_name.replace(suffix, '').replace('_', '-').lower()
+
+
+def name_patterns(patterns):
+    # selectors of services or environments: None for all of them, or a name or fnmatch pattern, e.g. 'webapp-*',
+    # or a list of them
+    if patterns is None or isinstance(patterns, (list, tuple)):
+        return patterns
+    return [patterns]
+
+
+def matches(name, patterns):
+    # whether a name is selected by the given name_patterns
+    return patterns is None or any(fnmatchcase(name, pattern) for pattern in patterns)
+
+
+# config_main.yaml is converted once per run into the slotted classes below, which the renderers and the diagram read
+#   attribute lookups are much faster than key lookups in ruamel's CommentedMaps, which also carry comments and
+#   formatting, so the model is smaller, and quicker to send to worker processes
+#   optional keys missing from the config, or left empty, are None
+#   values are kept as loaded, so they're written exactly as before. settings copied as they are to the k8s
+#   files (livenessProbe, initContainers) and the nested architecture_categories are kept as loaded too
+
+
+class PortMapping:
+    __slots__ = ('target', 'source', 'name')
+
+    def __init__(self, port_mapping):
+        self.target = port_mapping['target']
+        self.source = port_mapping.get('source')
+        self.name = port_mapping.get('name')
+
+
+class EnvVar:
+    # universal and include_in_k8 are flags, set whatever their value
+    __slots__ = ('name', 'value', 'universal', 'include_in_k8')
+
+    def __init__(self, env_var):
+        self.name = env_var['name']
+        self.value = env_var.get('value')
+        self.universal = 'universal' in env_var
+        self.include_in_k8 = 'include_in_k8' in env_var
+
+
+class Container:
+    # port_mappings is None, rather than empty, for containers without port_mappings
+    __slots__ = ('name', 'port_mappings', 'environment_variables', 'gpus', 'entrypoint', 'memory_limit', 'omit_image_registry', 'liveness_probe')
+
+    def __init__(self, container):
+        self.name = container['name']
+        port_mappings = container.get('port_mappings')
+        self.port_mappings = [PortMapping(port_mapping) for port_mapping in port_mappings] if port_mappings is not None else None
+        self.environment_variables = [EnvVar(env_var) for env_var in container.get('environment_variables') or []]
+        self.gpus = container.get('gpus')
+        self.entrypoint = container.get('entrypoint')
+        try:
+            self.memory_limit = container['resources']['limits']['memory']
+        except Exception:
+            self.memory_limit = None
+        # omit_image_registry_for_non_internet_environments is a flag
+        self.omit_image_registry = 'omit_image_registry_for_non_internet_environments' in container
+        self.liveness_probe = container.get('livenessProbe')
+
+
+class Service:
+    # fingerprint: hash of the service's whole config, part of the fingerprint of its files, see RenderJob
+    __slots__ = ('name', 'containers', 'ingress_path', 'replicas', 'init_containers', 'architecture_categories', 'fingerprint')
+
+    def __init__(self, service):
+        self.name = service['name']
+        self.containers = [Container(container) for container in service['containers']]
+        self.ingress_path = service.get('ingress_path')
+        self.replicas = service.get('replicas')
+        self.init_containers = service.get('initContainers')
+        self.architecture_categories = service.get('architecture_categories')
+        self.fingerprint = fingerprint(service)
+
+
+class VolumeMapping:
+    __slots__ = ('service_name', 'source', 'target', 'size')
+
+    def __init__(self, volume_mapping):
+        self.service_name = volume_mapping['service_name']
+        self.source = volume_mapping['source']
+        self.target = volume_mapping['target']
+        self.size = volume_mapping.get('size')
+
+
+class Environment:
+    # fingerprint: hash of the environment's whole config, part of the fingerprint of its services' files
+    __slots__ = ('name', 'image_registry', 'default_host', 'environment_variables', 'volume_mappings', 'fingerprint')
+
+    def __init__(self, environment):
+        self.name = environment['name']
+        self.image_registry = environment.get('image_registry')
+        self.default_host = environment.get('default_host')
+        self.environment_variables = [EnvVar(env_var) for env_var in environment.get('environment_variables') or []]
+        self.volume_mappings = [VolumeMapping(volume_mapping) for volume_mapping in environment.get('volume_mappings') or []]
+        self.fingerprint = fingerprint(environment)
+
+
+class ServiceIndex:
+    # name-indexed view of the services, built once per run
+    #   replaces the linear scans over all services that used to happen for every
+    #   SERVICE_HOST / SERVICE_PORT environment variable of every container
+    def __init__(self, services):
+        self.services = {}
+        self.containers = {}
+        self.main_ports = {}
+        for service in services:
+            self.services[service.name] = service
+            self.containers[service.name] = service.containers
+            # main port is the first port mapping of the first container, if any
+            if service.containers[0].port_mappings is not None:
+                self.main_ports[service.name] = service.containers[0].port_mappings[0].target
+        # env var name -> service name, filled in as env vars are looked up
+        self._env_var_services = {}
+
+    def __contains__(self, service_name):
+        return service_name in self.services
+
+    def get(self, service_name):
+        return self.services.get(service_name)
+
+    def main_port(self, service_name):
+        return self.main_ports.get(service_name)
+
+    def service_for_env_var(self, env_var_name, suffix=SERVICE_HOST_SUFFIX):
+        # service referenced by an env var such as WEBAPP_DB_SERVICE_SERVICE_HOST, or None
+        key = (env_var_name, suffix)
+        if key not in self._env_var_services:
+            service_name = env_var_to_service_name(env_var_name, suffix)
+            self._env_var_services[key] = service_name if service_name in self.services else None
+        return self._env_var_services[key]
+
+    def dependencies(self, service):
+        # names of the other services a service refers to with *_SERVICE_SERVICE_HOST env vars, in config order,
+        # the links drawn in the diagram
+        dependencies = []
+        for container in service.containers:
+            for environment_variable in container.environment_variables:
+                service_name = self.service_for_env_var(environment_variable.name)
+                if service_name is not None and service_name != service.name and service_name not in dependencies:
+                    dependencies.append(service_name)
+        return dependencies
+
+    def port_for_env_var(self, env_var_name):
+        # main port of the service referenced by an env var such as WEBAPP_DB_SERVICE_SERVICE_PORT, or None
+        service_name = self.service_for_env_var(env_var_name, SERVICE_PORT_SUFFIX)
+        if service_name is None:
+            return None
+        return self.main_ports.get(service_name)
+
+
+def volume_mappings_by_service(environment):
+    # service name -> volume mappings for that service in an environment, in config order
+    volume_mappings = {}
+    for volume_mapping in environment.volume_mappings:
+        volume_mappings.setdefault(volume_mapping.service_name, []).append(volume_mapping)
+    return volume_mappings
@@ -0,0 +1,110 @@
+import json
+import threading
+
+# redis connection pools, shared by every ArchitectureAsCode instance in the process
+#   keyed by (host, port), so instances pointing at the same redis reuse connections
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_redis_client(host, port):
+    # redis is imported here as it is slow to import and only needed for monitoring
+    import redis
+    key = (host or 'localhost', int(port) if port else 6379)
+    with _connection_pools_lock:
+        connection_pool = _connection_pools.get(key)
+        if connection_pool is None:
+            connection_pool = redis.ConnectionPool(host=key[0], port=key[1])
+            _connection_pools[key] = connection_pool
+    return redis.Redis(connection_pool=connection_pool)
+
+
+def reset_connection_pools():
+    # disconnect and forget all pooled connections, e.g. after forking
+    with _connection_pools_lock:
+        for connection_pool in _connection_pools.values():
+            connection_pool.disconnect()
+        _connection_pools.clear()
+
+
+def monitoring_settings_key(prefix):
+    return prefix.lower() + '-monitoring-settings'
+
+
+def build_monitoring_settings(services, prefix):
+    # collect the settings of the <prefix>-util-monitoring service into a single dict
+    monitoring_settings = {}
+    for service in services:
+        if service['name'] == prefix.lower() + '-util-monitoring':
+            monitoring_settings['refresh_interval_in_seconds'] = service['refresh_interval_in_seconds']
+            non_api_services_to_monitor = {}
+            if 'non_api_services_to_monitor' in service:
+                for non_api_service in service['non_api_services_to_monitor']:
+                    non_api_services_to_monitor[non_api_service['name']] = non_api_service['threshold_in_minutes']
+                monitoring_settings['non_api_services_to_monitor'] = non_api_services_to_monitor
+            api_services_to_monitor = {}
+            if 'api_services_to_monitor' in service:
+                for api_service in service['api_services_to_monitor']:
+                    api_services_to_monitor[api_service['name']] = api_service['endpoint']
+                monitoring_settings['api_services_to_monitor'] = api_services_to_monitor
+    return monitoring_settings
+
+
+def monitoring_settings_fields(monitoring_settings):
+    # flatten the settings into one hash field per monitored service, plus the refresh interval
+    #   each field is json encoded, so the consumer can decode fields independently
+    fields = {}
+    if 'refresh_interval_in_seconds' in monitoring_settings:
+        fields['refresh_interval_in_seconds'] = json.dumps(monitoring_settings['refresh_interval_in_seconds'])
+    services = {}
+    for name, threshold_in_minutes in monitoring_settings.get('non_api_services_to_monitor', {}).items():
+        services.setdefault(name, {})['threshold_in_minutes'] = threshold_in_minutes
+    for name, endpoint in monitoring_settings.get('api_services_to_monitor', {}).items():
+        services.setdefault(name, {})['endpoint'] = endpoint
+    for name, settings in services.items():
+        fields['service:' + name] = json.dumps(settings, sort_keys=True)
+    return fields
+
+
+def publish_monitoring_settings(redis_object, prefix, monitoring_settings):
+    # publish the settings in one transaction, only touching the fields that changed
+    #
+    # keys written, where <key> is <prefix>-monitoring-settings:
+    #   <key>                 the whole settings as one json blob, as before
+    #   <key>:fields          hash of refresh_interval_in_seconds and service:<name> fields
+    #   <key>:version         incremented whenever any field changes
+    #   <key>:field_versions  hash of field -> version in which it last changed or was removed
+    #
+    # a consumer that last saw version n only needs to fetch the fields whose
+    # field_versions entry is greater than n; a field missing from <key>:fields was removed
+    key = monitoring_settings_key(prefix)
+    fields_key = key + ':fields'
+    version_key = key + ':version'
+    field_versions_key = key + ':field_versions'
+    new_fields = monitoring_settings_fields(monitoring_settings)
+    blob = json.dumps(monitoring_settings)
+    result = {}
+
+    def publish(pipe):
+        current_fields = {
+            field.decode() if isinstance(field, bytes) else field: value.decode() if isinstance(value, bytes) else value
+            for field, value in pipe.hgetall(fields_key).items()
+        }
+        version = int(pipe.get(version_key) or 0)
+        changed = sorted(field for field, value in new_fields.items() if current_fields.get(field) != value)
+        removed = sorted(field for field in current_fields if field not in new_fields)
+
+        pipe.multi()
+        pipe.set(key, blob)
+        if changed or removed:
+            version += 1
+            if changed:
+                pipe.hset(fields_key, mapping={field: new_fields[field] for field in changed})
+            if removed:
+                pipe.hdel(fields_key, *removed)
+            pipe.hset(field_versions_key, mapping={field: version for field in changed + removed})
+            pipe.set(version_key, version)
+        result.update({'version': version, 'changed': changed, 'removed': removed})
+
+    redis_object.transaction(publish, fields_key, version_key)
+    return result
@@ -0,0 +1,857 @@
+import copy, io, os, stat, shutil, time
+from pathlib import Path
+
+from ruamel.yaml.comments import CommentedSeq
+from ruamel.yaml.nodes import ScalarNode
+from ruamel.yaml.scalarstring import DoubleQuotedScalarString, SingleQuotedScalarString
+
+from . import yaml
+from .env_vars import EnvironmentContext
+from .instrumentation import NullTracer
+from .manifest import content_hash, fingerprint, generator_fingerprint, load_manifest, new_manifest, save_manifest
+from .launcher import launcher_script
+from .model import ServiceIndex, docker_container_name, matches, name_patterns, volume_mappings_by_service
+from .yaml_backend import get_backend, k8s_file_extension
+
+# modes of the files yielded by RenderJob.iter_artifacts
+FILE_MODE = 0o644
+EXECUTABLE_MODE = 0o755
+
+# order of the documents in a bundle's k8s-all file, so kubectl apply creates what the others refer to first
+#   documents of other kinds come last
+K8S_KIND_ORDER = ('PersistentVolumeClaim', 'Service', 'Deployment', 'Ingress')
+
+
+class RenderJob:
+    # everything needed to write the deployment files of one run
+    #   built once in __call__ and handed to each worker process when rendering in parallel,
+    #   so a task only needs to name an environment and a range of services
+    #   incremental: skip services whose inputs haven't changed since the previous run, see manifest.py
+    #   service_patterns, environment_patterns: select the services and environments to render, see model.name_patterns
+    #     files of other services, and the folders of other environments, are left as they are
+    #   bundle: write each environment as one k8s-all file and one run_all.sh, see bundle_files
+    #   kustomize: write the k8s files as a kustomize base and overlays, rather than to each environment, see kustomize.py
+    #   store: a store.ContentStore the files are written to, and linked from, None to write them directly
+    def __init__(self, prefix, environments, services, env_var_plans, services_requiring_gpu, non_gpu_environment, output_folder,
+                 yaml_backend='roundtrip', k8s_format='yaml', incremental=True, service_patterns=None, environment_patterns=None,
+                 bundle=False, kustomize=False, store=None):
+        self.prefix = prefix
+        self.environments = environments
+        self.services = services
+        self.env_var_plans = env_var_plans
+        self.services_requiring_gpu = services_requiring_gpu
+        self.non_gpu_environment = non_gpu_environment
+        self.output_folder = output_folder
+        # backends are held by name, and looked up in each process, see yaml_backend.py
+        self.yaml_backend = yaml_backend
+        self.k8s_format = k8s_format
+        # both raise ValueError for unknown names, before anything is written
+        self.k8s_file_extension = k8s_file_extension(k8s_format)
+        get_backend(yaml_backend)
+        self.incremental = incremental
+        self.bundle = bundle
+        self.kustomize = kustomize
+        self.store = store
+        self.service_patterns = name_patterns(service_patterns)
+        if bundle and self.service_patterns is not None:
+            raise ValueError('a bundle holds all the services of an environment, so services can\'t be selected with bundle=True')
+        if kustomize and (bundle or service_patterns is not None or environment_patterns is not None):
+            raise ValueError('the kustomize base is shared by all services and environments, so kustomize=True can\'t be combined '
+                             'with bundle=True or with selected services or environments')
+        self.selected_services = None
+        if self.service_patterns is not None:
+            self.selected_services = set(service.name for service in services if matches(service.name, self.service_patterns))
+        # raises ValueError for selectors matching nothing, which are most likely typos, see also prepare_environment_folders
+        environment_patterns = name_patterns(environment_patterns)
+        self.environment_indexes = [index for index, environment in enumerate(environments) if matches(environment.name, environment_patterns)]
+        if not self.environment_indexes and environment_patterns is not None:
+            raise ValueError('no environment matches %s' % ', '.join(environment_patterns))
+        # manifests of the previous run, one per environment, None where the folder is regenerated from scratch
+        self.previous_manifests = [None] * len(environments)
+        self._environment_details = {}
+        # volume claims are the same in all environments using the same template, see k8s_volumes
+        #   (template name, service name, size) -> documents, and id(documents) -> [documents, text] once dumped
+        self._volume_claims = {}
+        self._volume_claim_texts = {}
+        self._generator_fingerprint = generator_fingerprint()
+        self._service_index = None
+
+    @property
+    def backend(self):
+        return get_backend(self.yaml_backend)
+
+    @property
+    def service_index(self):
+        # for the dependencies of launch.sh, built when first needed
+        if self._service_index is None:
+            self._service_index = ServiceIndex(self.services)
+        return self._service_index
+
+    def service_selected(self, service_name):
+        # also used for services no longer in config_main.yaml
+        return self.service_patterns is None or matches(service_name, self.service_patterns)
+
+    def environment_path(self, environment_index):
+        return os.path.join(self.output_folder, self.environments[environment_index].name)
+
+    def environment_details(self, environment_index):
+        # per-environment lookups, computed once per environment in each process
+        if environment_index not in self._environment_details:
+            environment = self.environments[environment_index]
+            self._environment_details[environment_index] = (volume_mappings_by_service(environment), EnvironmentContext(environment), environment.fingerprint)
+        return self._environment_details[environment_index]
+
+    def service_fingerprint(self, environment_index, service):
+        # hash of everything a service's files depend on in an environment
+        #   the compiled env var plans are included as they hold the ports resolved from other services
+        environment_fingerprint = self.environment_details(environment_index)[2]
+        plans = [(plan.docker_static, plan.k8s_static) for plan in self.env_var_plans[service.name]]
+        parts = [self._generator_fingerprint, environment_fingerprint, self.prefix, self.non_gpu_environment,
+                 service.name in self.services_requiring_gpu, service.fingerprint, plans, self.yaml_backend, self.k8s_format]
+        # only the docker run scripts are written to the environment, see render_service
+        if self.kustomize:
+            parts.append('kustomize')
+        return fingerprint(*parts)
+
+    def render_services(self, environment_index, start, end):
+        # write the files of services[start:end] for one environment, skipping services whose inputs are
+        # unchanged since the previous run and leaving files with unchanged content untouched
+        #   returns the manifest entry of each service, the changes made to the environment folder,
+        #   and timings for tracers, as (service name, seconds, files written, bytes written, skipped) per service
+        #   bundles are rendered whole, see render_bundle
+        if self.bundle:
+            return self.render_bundle(environment_index)
+        env_path = self.environment_path(environment_index)
+        previous_manifest = self.previous_manifests[environment_index]
+        previous_services = previous_manifest['services'] if previous_manifest else {}
+        entries = {}
+        changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': [], 'skipped_services': []}
+        stats = {'services': [], 'render_seconds': 0.0, 'write_seconds': 0.0, 'load_templates_seconds': 0.0}
+        templates = self.backend.templates
+        load_seconds = templates.load_seconds
+        for service in self.services[start:end]:
+            previous_entry = previous_services.get(service.name)
+            if self.selected_services is not None and service.name not in self.selected_services:
+                # not selected, its files are left as they are
+                if previous_entry:
+                    entries[service.name] = previous_entry
+                continue
+            started = time.perf_counter()
+            service_fingerprint = self.service_fingerprint(environment_index, service)
+            if self.incremental and previous_entry and previous_entry['fingerprint'] == service_fingerprint and \
+                    all(os.path.exists(os.path.join(env_path, file_name)) for file_name in previous_entry['files']):
+                entries[service.name] = previous_entry
+                changes['unchanged'].extend(previous_entry['files'])
+                changes['skipped_services'].append(service.name)
+                stats['services'].append((service.name, time.perf_counter() - started, 0, 0, True))
+                continue
+
+            files, images_to_pull = self.render_service(environment_index, service)
+            rendered = time.perf_counter()
+            file_hashes, files_written, bytes_written = self.write_files(env_path, files, previous_entry, changes)
+            entries[service.name] = {'fingerprint': service_fingerprint, 'files': file_hashes, 'images': images_to_pull}
+            finished = time.perf_counter()
+            stats['render_seconds'] += rendered - started
+            stats['write_seconds'] += finished - rendered
+            stats['services'].append((service.name, finished - started, files_written, bytes_written, False))
+        # templates are parsed on first use, while rendering a service
+        stats['load_templates_seconds'] = templates.load_seconds - load_seconds
+        stats['render_seconds'] -= stats['load_templates_seconds']
+        return entries, changes, stats
+
+    def write_file(self, env_path, file_name, content, executable=False, file_hash=None):
+        # write_file, or through the store, if any
+        if self.store is None:
+            return write_file(env_path, file_name, content, executable)
+        return self.store.write(env_path, file_name, content, file_hash or content_hash(content), executable)
+
+    def write_files(self, env_path, files, previous_entry, changes):
+        # writes the files whose content changed since the previous run, and deletes those no longer produced
+        #   returns the hash of each file, and the number of files and bytes written
+        previous_files = previous_entry['files'] if previous_entry else {}
+        file_hashes = {}
+        files_written = bytes_written = 0
+        for file_name, (content, executable) in files.items():
+            file_hashes[file_name] = content_hash(content)
+            if self.incremental and previous_files.get(file_name) == file_hashes[file_name] and os.path.exists(os.path.join(env_path, file_name)):
+                changes['unchanged'].append(file_name)
+                continue
+            changes['changed' if file_name in previous_files else 'added'].append(file_name)
+            bytes_written += self.write_file(env_path, file_name, content, executable, file_hashes[file_name])
+            files_written += 1
+        for file_name in previous_files:
+            if file_name not in files:
+                remove_file(env_path, file_name)
+                changes['removed'].append(file_name)
+        return file_hashes, files_written, bytes_written
+
+    def render_bundle(self, environment_index):
+        # render_services for bundles: writes the environment's bundle_files, unless none of its services changed
+        #   returns the manifest entry of the bundle, with all the docker pull lines, the changes and timings
+        env_path = self.environment_path(environment_index)
+        previous_manifest = self.previous_manifests[environment_index]
+        previous_entry = previous_manifest.get('bundle') if previous_manifest else None
+        changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': [], 'skipped_services': []}
+        stats = {'services': [], 'render_seconds': 0.0, 'write_seconds': 0.0, 'load_templates_seconds': 0.0}
+        templates = self.backend.templates
+        load_seconds = templates.load_seconds
+        started = time.perf_counter()
+        bundle_fingerprint = fingerprint([self.service_fingerprint(environment_index, service) for service in self.services])
+        if self.incremental and previous_entry and previous_entry['fingerprint'] == bundle_fingerprint and \
+                all(os.path.exists(os.path.join(env_path, file_name)) for file_name in previous_entry['files']):
+            changes['unchanged'].extend(previous_entry['files'])
+            changes['skipped_services'].extend(service.name for service in self.services)
+            stats['services'].append(('(bundle)', time.perf_counter() - started, 0, 0, True))
+            return previous_entry, changes, stats
+        files, images_to_pull = self.bundle_files(environment_index)
+        rendered = time.perf_counter()
+        file_hashes, files_written, bytes_written = self.write_files(env_path, files, previous_entry, changes)
+        finished = time.perf_counter()
+        stats['load_templates_seconds'] = templates.load_seconds - load_seconds
+        stats['render_seconds'] = rendered - started - stats['load_templates_seconds']
+        stats['write_seconds'] = finished - rendered
+        stats['services'].append(('(bundle)', finished - started, files_written, bytes_written, False))
+        return {'fingerprint': bundle_fingerprint, 'files': file_hashes, 'images': images_to_pull}, changes, stats
+
+    def bundle_files(self, environment_index):
+        # the files of a bundled environment, as render_service returns them
+        #   k8s-all: the k8s documents of all its services, in config order within each kind of K8S_KIND_ORDER,
+        #   so the whole environment is applied with one kubectl apply -f k8s-all.yaml
+        #   run_all.sh: the docker run scripts of all its services, one after the other
+        #   both are dumped, and written, in one go
+        documents = {}
+        launcher = []
+        images_to_pull = []
+        for service in self.services:
+            files, service_images = self.render_service_documents(environment_index, service)
+            images_to_pull.extend(service_images)
+            for file_name, (content, executable) in files.items():
+                if isinstance(content, str):
+                    launcher.append('# ' + file_name + '\n' + content + '\n')
+                else:
+                    for document in content:
+                        kind = document.get('kind')
+                        documents.setdefault(K8S_KIND_ORDER.index(kind) if kind in K8S_KIND_ORDER else len(K8S_KIND_ORDER), []).append(document)
+        ordered_documents = [document for rank in sorted(documents) for document in documents[rank]]
+        files = {
+            'k8s-all' + self.k8s_file_extension: (self.backend.dump_k8s(ordered_documents, self.k8s_format), False),
+            'run_all.sh': (''.join(launcher), True),
+        }
+        return files, images_to_pull
+
+    def iter_artifacts(self):
+        # yields (relative path, content, mode) for each file of the selected environments and services, as it is
+        # rendered, with paths as under output_folder, e.g. prod/k8s-webapp-django.yaml, and content as bytes
+        #   nothing is written, and only the docker pull lines of each environment are kept until its
+        #   pull_latest_images.sh, which comes after its services' files
+        #   with kustomize, the kustomize folder comes last
+        for environment_index in self.environment_indexes:
+            environment_name = self.environments[environment_index].name
+            images = []
+            if self.bundle:
+                files, images_to_pull = self.bundle_files(environment_index)
+                images.append(images_to_pull)
+                for file_name, (content, executable) in files.items():
+                    yield artifact(environment_name, file_name, content, executable)
+            launched_services = []
+            for service in self.services:
+                if self.bundle or self.selected_services is not None and service.name not in self.selected_services:
+                    continue
+                files, images_to_pull = self.render_service(environment_index, service)
+                images.append(images_to_pull)
+                launched_services.append((service.name, [file_name for file_name in files if file_name.startswith('run_')],
+                                          docker_container_names(service.name, images_to_pull), self.service_index.dependencies(service)))
+                for file_name, (content, executable) in files.items():
+                    yield artifact(environment_name, file_name, content, executable)
+            yield artifact(environment_name, 'pull_latest_images.sh', pull_script(images), True)
+            if not self.bundle:
+                yield artifact(environment_name, 'launch.sh', launcher_script(environment_name, launched_services, images)[0], True)
+        if self.kustomize:
+            from .kustomize import KUSTOMIZE_FOLDER, kustomize_files
+            for path, content in kustomize_files(self).items():
+                yield artifact(KUSTOMIZE_FOLDER, path, content)
+
+    def render_service(self, environment_index, service):
+        # returns the service's files as {file name: (content, executable)}, and the
+        # (container name, docker pull line) of each container, for the environment's pull_latest_images.sh
+        #   with kustomize, the k8s files are left out, as they're written to the kustomize folder
+        files, images_to_pull = self.render_service_documents(environment_index, service)
+        for file_name, (content, executable) in files.items():
+            if not isinstance(content, str):
+                files[file_name] = (self.dump_documents(content), executable)
+        return files, images_to_pull
+
+    def dump_documents(self, documents):
+        # text of a k8s file, dumped once for volume claims shared by several environments
+        text = self._volume_claim_texts.get(id(documents))
+        if text is not None and text[0] is documents:
+            return text[1]
+        text = self.backend.dump_k8s(documents, self.k8s_format)
+        if len(documents) == 1 and documents[0].get('kind') == 'PersistentVolumeClaim':
+            self._volume_claim_texts[id(documents)] = [documents, text]
+        return text
+
+    def render_service_documents(self, environment_index, service):
+        # as render_service, with the documents of each k8s file, rather than their text
+        environment = self.environments[environment_index]
+        environment_volume_mappings, environment_context, _ = self.environment_details(environment_index)
+        services_requiring_gpu = self.services_requiring_gpu
+        non_gpu_environment = self.non_gpu_environment
+        env_var_plans = self.env_var_plans
+        files = {}
+        images_to_pull = []
+
+        # write docker run script
+        #   most services should only have one container.
+        #   if service has > 1 container, to create one script per container and add suffix
+        add_container_suffix = False
+        if len(service.containers) > 1:
+            add_container_suffix = True
+        for container_idx, container in enumerate(service.containers):
+            # only create dockerfile if the service is not a placeholder
+            if 'placeholder-' not in service.name:
+                container_suffix = ''
+                if add_container_suffix:
+                    container_suffix = container.name
+                docker_run_script_name = 'run_' + service.name + container_suffix + '.sh'
+                with io.StringIO() as writer:
+                    writer.write('docker run --name ' + docker_container_name(service.name, container.name, add_container_suffix) + ' \\\n')
+                    writer.write('  --restart always -dit \\\n')
+
+                    # add port mappings
+                    if container.port_mappings is not None:
+                        for port_mapping in container.port_mappings:
+                            # if source not specified, assume it's same as target
+                            port_mapping_source = str(port_mapping.target)
+                            if port_mapping.source is not None:
+                                port_mapping_source = str(port_mapping.source)
+                            writer.write('  -p ' + str(port_mapping.target) + ':' + port_mapping_source + ' \\\n')
+
+                    # gpu-enabled
+                    if container.gpus is not None and not (non_gpu_environment in environment.name.lower() and service.name in services_requiring_gpu):
+                        writer.write('  --gpus ' + str(container.gpus) + ' \\\n')
+
+                    # write universal environment variables
+                    writer.write('  -e '  + self.prefix + '_ENVIRONMENT_NAME=' + environment.name + ' \\\n')
+                    writer.write('  -e '  + self.prefix + '_SERVICE_NAME=' + service.name + ' \\\n')
+                    if container.port_mappings is not None:
+                        writer.write('  -e '  + self.prefix + '_SERVICE_MAIN_PORT=' + str(container.port_mappings[0].target) + ' \\\n')
+
+                    # add container environment variables, resolved through the container's compiled plan
+                    #   covers variables that apply across all environments, environment-specific
+                    #   values (which can include overrides of general variables) and universal variables
+                    docker_gpu_off = non_gpu_environment in environment_context.name_lower and service.name in services_requiring_gpu
+                    for name, value in env_var_plans[service.name][container_idx].docker_env(environment_context, docker_gpu_off):
+                        writer.write('  -e ' + name + '=' + value + ' \\\n')
+
+                    # update env vars for haproxy
+                    if 'haproxy' in service.name:
+                        for port_mapping in container.port_mappings:
+                            if port_mapping.name is not None:
+                                writer.write('  -e ' + port_mapping.name + '=' + str(port_mapping.target) + ' \\\n')
+
+                    # check if elasticsearch container, and also memory limits
+                    # these two are bunched together as memory limits are critical for elasticsearch
+                    write_memory_limit = False
+                    default_es_memory_limit = '3G'
+                    if 'elasticsearch' in container.name:
+                        write_memory_limit = True
+                    # use the memory limit, if set, else the default
+                    if container.memory_limit is not None:
+                        es_memory_limit = container.memory_limit
+                        write_memory_limit = True
+                    else:
+                        es_memory_limit = default_es_memory_limit
+                    if write_memory_limit:
+                        writer.write('  -m ' + es_memory_limit + ' \\\n')
+
+                    # add volume mappings
+                    for vol_service in environment_volume_mappings.get(service.name, []):
+                        writer.write('  -v ' + vol_service.source + ':' + vol_service.target + ' \\\n')
+
+                    # add entrypoint:
+                    if container.entrypoint is not None:
+                        writer.write('  --entrypoint ' + container.entrypoint + ' \\\n')
+
+                    if container.omit_image_registry and 'soe' not in environment.name.lower():
+                        images_to_pull.append((container.name, 'docker pull ' + container.name + '\n'))
+                    else:
+                        images_to_pull.append((container.name, 'docker pull ' + os.path.join(environment.image_registry, container.name.split('/')[-1]) + '\n'))
+                    if container.omit_image_registry and 'soe' not in environment.name.lower():
+                        writer.write('  ' + container.name)
+                    else:
+                        writer.write('  ' + os.path.join(environment.image_registry, container.name.split('/')[-1]))
+
+                    # docker run scripts are made executable when written
+                    files[docker_run_script_name] = (writer.getvalue(), True)
+
+        # write k8s deployment file
+        #   once per service, as it doesn't depend on which container the docker script was written for
+        #   with kustomize, the k8s files are built by kustomize_files instead, see kustomize.py
+        if 'placeholder-' not in service.name and not self.kustomize:
+            self.render_k8s_documents(environment_index, service, files)
+
+        return files, images_to_pull
+
+    def render_k8s_documents(self, environment_index, service, files):
+        # adds the documents of a service's k8s files in an environment to files: its persistent volume claim, if any,
+        # then its deployment, service and ingress
+        #   the parts that depend on the environment are built by k8s_image, k8s_container_env and k8s_volumes,
+        #   which environment_k8s_documents also uses
+        environment = self.environments[environment_index]
+        backend = self.backend
+        k8s_deployment_file_name = 'k8s-' + service.name + self.k8s_file_extension
+        # get k8s template
+        if service.ingress_path is not None:
+            k8s_yml = backend.templates.get('k8s_template_ingress.yaml')
+        else:
+            k8s_yml = backend.templates.get('k8s_template.yaml')
+        # figure out which config is which
+        k8s_deployment_index = k8s_service_index = k8s_ingress_index = 0
+        for num, name in enumerate(k8s_yml, start=0):
+            if name['kind'] == 'Deployment':
+                k8s_deployment_index = num
+            elif name['kind'] == 'Service':
+                k8s_service_index = num
+            elif name['kind'] == 'Ingress':
+                k8s_ingress_index = num
+
+        # populate deployment params
+        k8s_deployment_details = k8s_yml[k8s_deployment_index]
+        k8s_deployment_details['metadata']['name'] = service.name
+        k8s_deployment_details['metadata']['labels']['app'] = service.name
+        k8s_deployment_details['spec']['selector']['matchLabels']['app'] = service.name
+        k8s_deployment_details['spec']['template']['metadata']['labels']['app'] = service.name
+
+        if service.replicas is not None:
+            k8s_deployment_details['spec']['replicas'] = service.replicas
+
+        default_es_memory_limit = '3G'
+        for idx, container in enumerate(service.containers, start=0):
+            if idx == 0:
+                k8s_deployment_details['spec']['template']['spec']['containers'][idx]['name'] = service.name
+            else:
+                k8s_deployment_details['spec']['template']['spec']['containers'].append({'name':service.name})
+            k8s_deployment_details['spec']['template']['spec']['containers'][idx]['image'] = self.k8s_image(environment, service, container)
+
+            # add stdin and tty to container, equivalent of -it in docker
+            k8s_deployment_details['spec']['template']['spec']['containers'][idx]['stdin'] = True
+            k8s_deployment_details['spec']['template']['spec']['containers'][idx]['tty'] = True
+
+            # add universal and container environment variables
+            #   the env key is left out if there are none
+            k8s_env = self.k8s_container_env(environment_index, service, idx)
+            if k8s_env:
+                k8s_deployment_details['spec']['template']['spec']['containers'][idx]['env'] = k8s_env
+
+            # check if elasticsearch container, and also memory limits
+            # these two are bunched together as memory limits are critical for elasticsearch
+            write_memory_limit = False
+            if 'elasticsearch' in container.name:
+                write_memory_limit = True
+            # use the memory limit, if set, else the default
+            if container.memory_limit is not None:
+                es_memory_limit = container.memory_limit
+                write_memory_limit = True
+            else:
+                es_memory_limit = default_es_memory_limit
+            if write_memory_limit:
+                k8s_deployment_details['spec']['template']['spec']['containers'][idx]['resources'] = {'limits':{'memory':es_memory_limit}}
+
+            # add entrypoint, if present
+            #   k8s splits it into the command and its args, each written as a list
+            if container.entrypoint is not None:
+                entrypoint = container.entrypoint.split()
+                k8s_deployment_details['spec']['template']['spec']['containers'][idx]['command'] = k8s_sequence(entrypoint[:1])
+                if len(entrypoint) > 1:
+                    k8s_deployment_details['spec']['template']['spec']['containers'][idx]['args'] = k8s_sequence(entrypoint[1:])
+
+            # add livenessProbe if present
+            if container.liveness_probe is not None:
+                k8s_deployment_details['spec']['template']['spec']['containers'][idx]['livenessProbe'] = container.liveness_probe
+
+            # add GPU if present
+            if container.gpus is not None:
+                k8s_deployment_details['spec']['template']['spec']['containers'][idx]['limits'] = {'nvidia.com/gpu':container.gpus}
+
+        # add initContainer if present
+        if service.init_containers is not None:
+            k8s_deployment_details['spec']['template']['spec']['initContainers'] = k8s_init_containers(service.init_containers)
+
+        # update volume mappings
+        #   on the last container, as idx is left by the loop above
+        volumes = self.k8s_volumes(environment_index, service)
+        if volumes is not None:
+            k8s_volumes, k8s_volume_mounts, k8s_volume_claim_file_name, k8s_volume_claim = volumes
+            k8s_deployment_details['spec']['template']['spec']['volumes'] = k8s_volumes
+            k8s_deployment_details['spec']['template']['spec']['containers'][idx]['volumeMounts'] = k8s_volume_mounts
+            files[k8s_volume_claim_file_name] = (k8s_volume_claim, False)
+
+        # populate service params
+        k8s_service_details = k8s_yml[k8s_service_index]
+        k8s_service_details['metadata']['name'] = service.name + '-service'
+        k8s_service_details['spec']['selector']['app'] = service.name 
+        # add port mappings
+        if container.port_mappings is not None:
+            # if service has > 1 port, k8s needs each port to be named
+            add_port_names = False
+            if len(container.port_mappings) > 1:
+                add_port_names = True
+            for idx, port_mapping in enumerate(container.port_mappings, start=0):
+            # if source not specified, assume it's same as target
+                k8s_service_details['spec']
+                if idx == 0:
+                    k8s_service_details['spec']['ports'][idx]['port'] = port_mapping.target
+                else:
+                    k8s_service_details['spec']['ports'].append({'port':port_mapping.target})
+                if port_mapping.source is not None:
+                    k8s_service_details['spec']['ports'][idx]['targetPort'] = port_mapping.source
+                if add_port_names:
+                    k8s_service_details['spec']['ports'][idx]['name'] = 'port' + str(idx)
+
+        # update ingress details, if present
+        if service.ingress_path is not None and container.port_mappings is not None:
+            k8s_ingress_details = k8s_yml[k8s_ingress_index]
+            k8s_ingress_details['metadata']['name'] = service.name + '-ingress'
+            k8s_ingress_details['spec']['rules'][0]['http']['paths'][0]['path'] = service.ingress_path
+            k8s_ingress_details['spec']['rules'][0]['http']['paths'][0]['backend']['service']['name'] = service.name + '-service'
+            k8s_ingress_details['spec']['rules'][0]['http']['paths'][0]['backend']['service']['port']['number'] = container.port_mappings[0].target
+
+        files[k8s_deployment_file_name] = (k8s_yml, False)
+
+    def k8s_image(self, environment, service, container):
+        # image of a container of the deployment, named after the service's first container
+        if container.omit_image_registry and 'soe' not in environment.name.lower():
+            return service.containers[0].name
+        return os.path.join(environment.image_registry, service.containers[0].name.split('/')[-1])
+
+    def k8s_container_env(self, environment_index, service, container_index):
+        # env of a container of the deployment: the universal variables, the container's, resolved through the
+        # same compiled plan as the docker script, and haproxy's ports
+        environment = self.environments[environment_index]
+        environment_context = self.environment_details(environment_index)[1]
+        container = service.containers[container_index]
+        k8s_env = [{'name':self.prefix + '_ENVIRONMENT_NAME', 'value':k8s_env_value(environment.name)},
+                   {'name':self.prefix + '_SERVICE_NAME', 'value':k8s_env_value(service.name)}]
+        if container.port_mappings is not None:
+            k8s_env.append({'name':self.prefix + '_SERVICE_MAIN_PORT', 'value':k8s_env_value(container.port_mappings[0].target)})
+        k8s_gpu_off = 'soe' in environment_context.name_lower and service.name in self.services_requiring_gpu
+        for name, value in self.env_var_plans[service.name][container_index].k8s_env(environment_context, k8s_gpu_off):
+            k8s_env.append({'name':name, 'value':k8s_env_value(value)})
+        # update env vars for haproxy
+        if 'haproxy' in service.name:
+            for port_mapping in container.port_mappings:
+                if port_mapping.name is not None:
+                    k8s_env.append({'name':port_mapping.name, 'value':k8s_env_value(str(port_mapping.target))})
+        return k8s_env
+
+    def k8s_volumes(self, environment_index, service):
+        # volumes and volume mounts of the deployment, and the file name and documents of the persistent volume claim,
+        # for the service's last volume mapping in the environment, or None if it has none
+        volume_mappings = self.environment_details(environment_index)[0].get(service.name)
+        if not volume_mappings:
+            return None
+        vol_service = volume_mappings[-1]
+        k8s_volumes = [{'name':service.name + '-pv-storage', 'persistentVolumeClaim':{'claimName':service.name + '-pv-claim'}}]
+        k8s_volume_mounts = [{'mountPath':vol_service.target, 'name':service.name + '-pv-storage'}]
+        if 'soe' in self.environments[environment_index].name.lower():
+            k8s_volume_claim_template = 'k8s_template_volume_claim_tanzu.yaml'
+        else:
+            k8s_volume_claim_template = 'k8s_template_volume_claim.yaml'
+        # built, and dumped, once for all the environments of a run using the same template
+        #   the size is keyed with its type, as e.g. 10 and '10' are written differently
+        volume_claim_key = (k8s_volume_claim_template, service.name, type(vol_service.size), vol_service.size)
+        if volume_claim_key not in self._volume_claims:
+            k8s_volume_claim = self.backend.templates.get(k8s_volume_claim_template)[0]
+            k8s_volume_claim['metadata']['name'] = service.name + '-pv-claim'
+            if vol_service.size is not None:
+                k8s_volume_claim['spec']['resources']['requests']['storage'] = vol_service.size
+            self._volume_claims[volume_claim_key] = [k8s_volume_claim]
+        k8s_volume_claim_file_name = 'k8s-' + service.name + '-pv-claim' + self.k8s_file_extension
+        return k8s_volumes, k8s_volume_mounts, k8s_volume_claim_file_name, self._volume_claims[volume_claim_key]
+
+    def environment_k8s_documents(self, environment_index, service, base_files):
+        # the files render_k8s_documents would add for the environment, from those it added for another environment,
+        # base_files, building only the parts that depend on the environment, see render_k8s_documents
+        #   the deployment is copied down to its containers, the rest of the documents is shared with base_files
+        environment = self.environments[environment_index]
+        files = {}
+        volumes = self.k8s_volumes(environment_index, service)
+        if volumes is not None:
+            files[volumes[2]] = (volumes[3], False)
+        k8s_deployment_file_name = 'k8s-' + service.name + self.k8s_file_extension
+        documents = []
+        for document in base_files[k8s_deployment_file_name][0]:
+            if document['kind'] == 'Deployment':
+                document = copy.copy(document)
+                spec = document['spec'] = copy.copy(document['spec'])
+                template = spec['template'] = copy.copy(spec['template'])
+                pod_spec = template['spec'] = copy.copy(template['spec'])
+                k8s_containers = pod_spec['containers'] = copy.copy(pod_spec['containers'])
+                for idx, container in enumerate(service.containers):
+                    k8s_container = k8s_containers[idx] = copy.copy(k8s_containers[idx])
+                    k8s_container['image'] = self.k8s_image(environment, service, container)
+                    k8s_env = self.k8s_container_env(environment_index, service, idx)
+                    if k8s_env:
+                        k8s_container['env'] = k8s_env
+                k8s_container.pop('volumeMounts', None)
+                pod_spec.pop('volumes', None)
+                if volumes is not None:
+                    pod_spec['volumes'], k8s_container['volumeMounts'] = volumes[:2]
+            documents.append(document)
+        files[k8s_deployment_file_name] = (documents, False)
+        return files
+
+    def manifest_service_names(self, manifest):
+        # services of an environment's manifest, in config order
+        #   services no longer in config_main.yaml, whose files were left by a run not selecting them, come last
+        service_names = [service.name for service in self.services]
+        in_config = set(service_names)
+        return service_names + [service_name for service_name in manifest['services'] if service_name not in in_config]
+
+    def pull_latest_images_script(self, manifest):
+        # convenience script to pull images
+        images = [manifest['services'].get(service_name, {}).get('images', []) for service_name in self.manifest_service_names(manifest)]
+        if 'bundle' in manifest:
+            images.append(manifest['bundle']['images'])
+        return pull_script(images)
+
+    def launcher(self, environment_index, manifest):
+        # launch.sh, starting the environment's docker containers in dependency order, see launcher.py
+        #   returns the script, and the dependency cycles
+        services = []
+        images = []
+        for service_name in self.manifest_service_names(manifest):
+            entry = manifest['services'].get(service_name)
+            if entry is None:
+                continue
+            run_scripts = [file_name for file_name in entry['files'] if file_name.startswith('run_')]
+            service = self.service_index.get(service_name)
+            services.append((service_name, run_scripts, docker_container_names(service_name, entry['images']),
+                             self.service_index.dependencies(service) if service is not None else []))
+            images.append(entry['images'])
+        return launcher_script(self.environments[environment_index].name, services, images)
+
+
+def docker_container_names(service_name, images_to_pull):
+    # the --name of each of a service's containers, from its (container name, docker pull line), one per run script
+    return [docker_container_name(service_name, container_name, len(images_to_pull) > 1) for container_name, _ in images_to_pull]
+
+
+def pull_script(images):
+    # pull_latest_images.sh, from lists of (container name, docker pull line)
+    #   each image is pulled once, using the docker pull line of the first container that uses it
+    pulled = set()
+    lines = []
+    for images_to_pull in images:
+        for container_name, pull_line in images_to_pull:
+            if container_name not in pulled:
+                pulled.add(container_name)
+                lines.append(pull_line)
+    return ''.join(lines)
+
+
+def k8s_sequence(items):
+    # k8s command / args, written as a flow style list of quoted strings, e.g. command: ['python']
+    sequence = CommentedSeq([SingleQuotedScalarString(item) for item in items])
+    sequence.fa.set_flow_style()
+    return sequence
+
+
+def k8s_env_value(value):
+    # k8s only accepts strings as env var values
+    #   numbers, and strings starting with a digit that would otherwise be written unquoted (e.g. ip addresses),
+    #   are double quoted. other strings that would read back as another type are single quoted when dumped
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        return DoubleQuotedScalarString(str(value))
+    value = str(value)
+    if value[:1].isdigit() and yaml.resolver.resolve(ScalarNode, value, (True, False)) == 'tag:yaml.org,2002:str':
+        return DoubleQuotedScalarString(value)
+    return value
+
+
+def k8s_init_containers(init_containers):
+    # initContainers are copied from config_main.yaml as they are, apart from their env var values
+    #   copied first, as the config is shared by all environments
+    init_containers = copy.deepcopy(init_containers)
+    for init_container in init_containers:
+        for env_var in init_container.get('env', []):
+            if 'value' in env_var:
+                env_var['value'] = k8s_env_value(env_var['value'])
+    return init_containers
+
+
+def artifact(environment_name, file_name, content, executable=False):
+    # (relative path, content, mode) of a file yielded by RenderJob.iter_artifacts
+    return environment_name + '/' + file_name, content.encode(), EXECUTABLE_MODE if executable else FILE_MODE
+
+
+def write_file(env_path, file_name, content, executable=False):
+    # returns the number of bytes written
+    file_path = os.path.join(env_path, file_name)
+    replace_linked_file(file_path)
+    with open(file_path, 'w') as writer:
+        writer.write(content)
+    if executable:
+        f = Path(file_path)
+        f.chmod(f.stat().st_mode | stat.S_IEXEC)
+    return len(content.encode())
+
+
+def replace_linked_file(file_path):
+    # files linked from a content store (see store.py) are deleted before being written, rather than written
+    # through, which would change the blob, and every other file linked to it
+    try:
+        file_stat = os.lstat(file_path)
+    except FileNotFoundError:
+        return
+    if stat.S_ISLNK(file_stat.st_mode) or file_stat.st_nlink > 1:
+        os.remove(file_path)
+
+
+def remove_file(env_path, file_name):
+    try:
+        os.remove(os.path.join(env_path, file_name))
+    except FileNotFoundError:
+        pass
+
+
+def render_tasks(environment_indexes, number_of_services, workers):
+    # split the run into (environment index, first service, last service) tasks
+    #   serial runs render each environment in one task, parallel runs split the services of each
+    #   environment into chunks, so a pool is kept busy even when there are fewer environments than workers
+    chunk_size = number_of_services
+    if workers and workers > 1:
+        chunk_size = -(-len(environment_indexes) * number_of_services // (workers * 4))
+        chunk_size = max(1, min(chunk_size, number_of_services))
+    tasks = []
+    for environment_index in environment_indexes:
+        for start in range(0, number_of_services, max(chunk_size, 1)):
+            tasks.append((environment_index, start, min(start + chunk_size, number_of_services)))
+    return tasks
+
+
+# the job of the current worker process, set once by the pool initializer
+_worker_job = None
+
+
+def _init_worker(job):
+    global _worker_job
+    _worker_job = job
+
+
+def _render_task(task):
+    return _worker_job.render_services(*task)
+
+
+def prepare_environment_folders(job):
+    # create each selected environment folder and load the manifest of the previous run
+    #   folders without a manifest (or all folders, if not incremental) are deleted and regenerated from scratch,
+    #   unless only some services are selected, in which case the files of the others are kept
+    for environment_index in job.environment_indexes:
+        env_path = job.environment_path(environment_index)
+        if job.selected_services is not None:
+            job.previous_manifests[environment_index] = load_manifest(env_path) or new_manifest()
+        else:
+            job.previous_manifests[environment_index] = load_manifest(env_path) if job.incremental else None
+    # services can also be selected to delete the files of services no longer in config_main.yaml
+    if job.selected_services is not None and not job.selected_services and \
+            not any(job.service_selected(service_name) for environment_index in job.environment_indexes
+                    for service_name in job.previous_manifests[environment_index]['services']):
+        raise ValueError('no service matches %s' % ', '.join(job.service_patterns))
+    for environment_index in job.environment_indexes:
+        env_path = job.environment_path(environment_index)
+        previous_manifest = job.previous_manifests[environment_index]
+        if previous_manifest is None and os.path.exists(env_path):
+            shutil.rmtree(env_path)
+        os.makedirs(env_path, exist_ok=True)
+
+
+def render(job, workers=None, report=None, tracer=None):
+    # render all environments and services, in a pool of worker processes if workers > 1
+    #   the files shared by all services of an environment, and its manifest, are written afterwards
+    #   from the results in task order, so the output is the same as a serial run
+    #   the timings measured in each task are passed on to the tracer, if any
+    if tracer is None:
+        tracer = NullTracer()
+    # bundles are rendered whole, in a task per environment
+    tasks = render_tasks(job.environment_indexes, len(job.services), 1 if job.bundle else workers)
+    with tracer.phase('render_services'):
+        if workers and workers > 1 and len(tasks) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(job,)) as executor:
+                results = list(executor.map(_render_task, tasks))
+        else:
+            results = [job.render_services(*task) for task in tasks]
+
+    manifests = {environment_index: new_manifest() for environment_index in job.environment_indexes}
+    all_changes = {environment_index: {} for environment_index in job.environment_indexes}
+    for (environment_index, start, end), (entries, changes, stats) in zip(tasks, results):
+        if job.bundle:
+            manifests[environment_index]['bundle'] = entries
+        else:
+            manifests[environment_index]['services'].update(entries)
+        for key, values in changes.items():
+            all_changes[environment_index].setdefault(key, []).extend(values)
+        if tracer.enabled:
+            record_stats(tracer, job.environments[environment_index].name, stats)
+
+    tracer.start('write_environment_files')
+    for environment_index, manifest in manifests.items():
+        env_path = job.environment_path(environment_index)
+        changes = all_changes[environment_index]
+        previous_manifest = job.previous_manifests[environment_index] or new_manifest()
+
+        # delete the files of services that are no longer in config_main.yaml
+        #   unless they aren't selected, in which case they're left for a run that selects them
+        for service_name, previous_entry in previous_manifest['services'].items():
+            if service_name not in manifest['services']:
+                if not job.service_selected(service_name):
+                    manifest['services'][service_name] = previous_entry
+                    continue
+                for file_name in previous_entry['files']:
+                    remove_file(env_path, file_name)
+                    changes.setdefault('removed', []).append(file_name)
+        # and of the bundle, when no longer bundled
+        if 'bundle' in previous_manifest and not job.bundle:
+            for file_name in previous_manifest['bundle']['files']:
+                remove_file(env_path, file_name)
+                changes.setdefault('removed', []).append(file_name)
+
+        # write convenience scripts to pull images and start the containers, and make them executable
+        #   a bundle's run_all.sh already starts all of its containers
+        shared_files = {'pull_latest_images.sh': job.pull_latest_images_script(manifest)}
+        if not job.bundle:
+            shared_files['launch.sh'], cycles = job.launcher(environment_index, manifest)
+            changes.setdefault('dependency_cycles', []).extend(cycles)
+        for file_name, content in shared_files.items():
+            manifest['shared'][file_name] = content_hash(content)
+            if previous_manifest['shared'].get(file_name) == manifest['shared'][file_name] and os.path.exists(os.path.join(env_path, file_name)):
+                changes.setdefault('unchanged', []).append(file_name)
+            else:
+                changes.setdefault('changed' if file_name in previous_manifest['shared'] else 'added', []).append(file_name)
+                tracer.record_files(1, job.write_file(env_path, file_name, content, True, manifest['shared'][file_name]))
+        for file_name in previous_manifest['shared']:
+            if file_name not in shared_files:
+                remove_file(env_path, file_name)
+                changes.setdefault('removed', []).append(file_name)
+
+        tracer.record_files(1, save_manifest(env_path, manifest))
+        if report is not None:
+            report.merge(job.environments[environment_index].name, changes)
+    tracer.stop('write_environment_files')
+    return report
+
+
+def record_stats(tracer, environment_name, stats):
+    # the time spent in worker processes is added up, so with workers > 1 it can exceed the wall time of render_services
+    rendered_services = [service for service in stats['services'] if not service[4]]
+    tracer.add_time('render_files', stats['render_seconds'], len(rendered_services))
+    tracer.add_time('write_files', stats['write_seconds'], len(rendered_services))
+    if stats['load_templates_seconds']:
+        tracer.add_time('load_templates', stats['load_templates_seconds'])
+    for service_name, seconds, files_written, bytes_written, skipped in stats['services']:
+        tracer.record_service(environment_name, service_name, seconds, files_written, bytes_written, skipped)
+        tracer.record_files(files_written, bytes_written)
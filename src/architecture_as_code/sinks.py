@@ -0,0 +1,146 @@
+import io, os, stat, sys, time
+from abc import ABC, abstractmethod
+
+from .render import replace_linked_file
+
+# sinks receive the files yielded by ArchitectureAsCode.iter_artifacts, as (relative path, content as bytes, mode)
+#
+#   with TarSink('deployment_files.tar.gz') as sink:
+#       write_artifacts(aac.iter_artifacts('config_main.yaml'), sink)
+#
+# each file is passed on as soon as it is rendered, so memory use doesn't grow with the size of the config
+# (except with MemorySink, which keeps everything). sinks derive from Sink, which closes them at the end of a with block
+
+
+def write_artifacts(artifacts, sink):
+    # writes each artifact to the sink, returning the number of files and bytes written
+    #   the sink is left open, so several runs can be written to the same archive or stream
+    files = total_bytes = 0
+    for path, content, mode in artifacts:
+        sink.write(path, content, mode)
+        files += 1
+        total_bytes += len(content)
+    return files, total_bytes
+
+
+def k8s_artifacts(artifacts):
+    # only the k8s files, e.g. to pipe into kubectl apply -f -
+    for path, content, mode in artifacts:
+        if os.path.basename(path).startswith('k8s-'):
+            yield path, content, mode
+
+
+class Sink(ABC):
+    @abstractmethod
+    def write(self, path, content, mode):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FileSystemSink(Sink):
+    # writes the files under folder, as __call__ does, but without a manifest, or deleting anything
+    def __init__(self, folder='deployment_files'):
+        self.folder = folder
+
+    def write(self, path, content, mode):
+        file_path = os.path.join(self.folder, *path.split('/'))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        replace_linked_file(file_path)
+        with open(file_path, 'wb') as writer:
+            writer.write(content)
+        # the executable bit is added to the mode the file was created with, as __call__ does
+        if mode & stat.S_IXUSR:
+            os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IEXEC)
+
+
+class MemorySink(Sink):
+    # keeps the files in files, as {path: (content, mode)}
+    def __init__(self):
+        self.files = {}
+
+    def write(self, path, content, mode):
+        self.files[path] = (content, mode)
+
+
+def open_output(file, binary_mode):
+    # file name, or an open binary file object, e.g. sys.stdout.buffer, which is left open on close
+    #   returns (file object, whether to close it)
+    if isinstance(file, (str, bytes, os.PathLike)):
+        return open(file, binary_mode), True
+    return file, False
+
+
+class TarSink(Sink):
+    # streams the files to a tar archive, written sequentially, so it can go to a pipe
+    #   compression: '' for none, 'gz', 'bz2' or 'xz', by default taken from the file name, e.g. .tar.gz
+    def __init__(self, file, compression=None):
+        import tarfile
+        if compression is None:
+            compression = ''
+            if isinstance(file, str):
+                for extension, extension_compression in (('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2'), ('.tar.xz', 'xz')):
+                    if file.endswith(extension):
+                        compression = extension_compression
+        self.fileobj, self._close_fileobj = open_output(file, 'wb')
+        self.tar = tarfile.open(fileobj=self.fileobj, mode='w|' + compression)
+        self.mtime = time.time()
+
+    def write(self, path, content, mode):
+        import tarfile
+        info = tarfile.TarInfo(path)
+        info.size = len(content)
+        info.mode = mode
+        info.mtime = self.mtime
+        self.tar.addfile(info, io.BytesIO(content))
+
+    def close(self):
+        self.tar.close()
+        if self._close_fileobj:
+            self.fileobj.close()
+
+
+class ZipSink(Sink):
+    # writes the files to a zip archive, also to unseekable streams
+    def __init__(self, file, compression=None):
+        import zipfile
+        self.fileobj, self._close_fileobj = open_output(file, 'wb')
+        self.zip = zipfile.ZipFile(self.fileobj, 'w', zipfile.ZIP_DEFLATED if compression is None else compression)
+        self.date_time = time.localtime()[:6]
+
+    def write(self, path, content, mode):
+        import zipfile
+        info = zipfile.ZipInfo(path, self.date_time)
+        info.compress_type = self.zip.compression
+        info.external_attr = (stat.S_IFREG | mode) << 16
+        self.zip.writestr(info, content)
+
+    def close(self):
+        self.zip.close()
+        if self._close_fileobj:
+            self.fileobj.close()
+
+
+class StdoutSink(Sink):
+    # writes the content of each file, one after the other, to a binary stream, stdout by default
+    #   yaml files are separated by ---, so the k8s files of a run make one multi-document stream, e.g. for
+    #   kubectl apply -f -, json files are separated by a new line, which kubectl also reads as a stream
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout.buffer
+
+    def write(self, path, content, mode):
+        if path.endswith('.yaml') and not content.startswith(b'---'):
+            self.stream.write(b'---\n')
+        self.stream.write(content)
+        if not content.endswith(b'\n'):
+            self.stream.write(b'\n')
+
+    def close(self):
+        self.stream.flush()
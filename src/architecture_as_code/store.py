@@ -0,0 +1,117 @@
+import os, shutil, stat, tempfile
+
+# content-addressed store of the generated files
+#
+#   aac('config_main.yaml', store=True)                     # deployment_files/.aac-store, hardlinks
+#   aac('config_main.yaml', store=True, store_links='symlink')
+#
+# each file is hashed, written once to the store as a blob named after its hash, and linked into the environment
+# folders, so files found in several environments, e.g. persistent volume claims, are only kept once on disk
+#   hardlink: the environment folders hold ordinary files, sharing the blob's inode. falls back to copies
+#             where hardlinks aren't supported, e.g. across file systems
+#   symlink: relative symbolic links to the blobs, so the output folder can be moved as a whole
+#   copy: copies of the blobs, for tools that don't follow links
+# files are never written in place, as that would also change the blob, and every other file linked to it:
+# they are replaced with a new link, see also render.write_file
+
+STORE_FOLDER = '.aac-store'
+STORE_LINKS = ('hardlink', 'symlink', 'copy')
+# written to the store once a hardlink has fallen back to a copy: blobs copied from aren't linked, so whether
+# they're still used can't be told from their link count, and they're no longer pruned
+COPIED_MARKER = '.copied'
+
+
+class ContentStore:
+    def __init__(self, folder, links='hardlink'):
+        if links not in STORE_LINKS:
+            raise ValueError('unknown store links %r, expected one of %s' % (links, ', '.join(STORE_LINKS)))
+        self.folder = folder
+        self.links = links
+
+    def blob_path(self, content_hash, executable):
+        # blobs are spread over folders named after the first two characters of their hash
+        #   executable files are kept apart, as linked files share their mode
+        return os.path.join(self.folder, content_hash[:2], content_hash + ('.x' if executable else ''))
+
+    def put(self, content, content_hash, executable=False):
+        # writes the blob, unless it's already in the store, returning its path and the number of bytes written
+        blob_path = self.blob_path(content_hash, executable)
+        if os.path.exists(blob_path):
+            return blob_path, 0
+        folder = os.path.dirname(blob_path)
+        os.makedirs(folder, exist_ok=True)
+        data = content.encode()
+        # written to a temporary file first, so a blob is either complete or missing, even if a run is interrupted
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=folder)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as writer:
+                writer.write(data)
+            mode = 0o644 & ~current_umask()
+            os.chmod(temporary_path, mode | stat.S_IEXEC if executable else mode)
+            os.replace(temporary_path, blob_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return blob_path, len(data)
+
+    def link(self, blob_path, file_path):
+        # replaces file_path with a link to (or a copy of) the blob
+        temporary_path = os.path.join(os.path.dirname(file_path), '.' + os.path.basename(file_path) + '.aac-tmp')
+        if os.path.lexists(temporary_path):
+            os.remove(temporary_path)
+        links = self.links
+        if links == 'hardlink':
+            try:
+                os.link(blob_path, temporary_path)
+            except OSError:
+                links = 'copy'
+                self.mark_copied()
+        if links == 'symlink':
+            os.symlink(os.path.relpath(blob_path, os.path.dirname(file_path)), temporary_path)
+        elif links == 'copy':
+            shutil.copy(blob_path, temporary_path)
+        os.replace(temporary_path, file_path)
+
+    def write(self, env_path, file_name, content, content_hash, executable=False):
+        # render.write_file, through the store. returns the number of bytes written to the store
+        blob_path, bytes_written = self.put(content, content_hash, executable)
+        self.link(blob_path, os.path.join(env_path, file_name))
+        return bytes_written
+
+    def mark_copied(self):
+        marker_path = os.path.join(self.folder, COPIED_MARKER)
+        if not os.path.exists(marker_path):
+            open(marker_path, 'w').close()
+
+    def prune(self):
+        # deletes the blobs no longer linked from any folder, which can only be told for hardlinks, and only
+        # while none has fallen back to a copy, see COPIED_MARKER
+        #   returns the number of blobs deleted
+        if self.links != 'hardlink' or not os.path.isdir(self.folder) or os.path.exists(os.path.join(self.folder, COPIED_MARKER)):
+            return 0
+        pruned = 0
+        for prefix in os.listdir(self.folder):
+            folder = os.path.join(self.folder, prefix)
+            if not os.path.isdir(folder):
+                continue
+            for blob_name in os.listdir(folder):
+                blob_path = os.path.join(folder, blob_name)
+                if os.stat(blob_path).st_nlink == 1:
+                    os.remove(blob_path)
+                    pruned += 1
+            if not os.listdir(folder):
+                os.rmdir(folder)
+        return pruned
+
+
+_umask = None
+
+
+def current_umask():
+    # the process's umask, so blobs get the same mode as files written directly
+    global _umask
+    if _umask is None:
+        _umask = os.umask(0)
+        os.umask(_umask)
+    return _umask
@@ -0,0 +1,51 @@
+import copy
+import threading
+import time
+
+
+class TemplateRegistry:
+    # loads and parses each k8s template once, then hands out independent copies
+    #   parsing with ruamel is far more expensive than copying the parsed documents,
+    #   and __call__ needs a fresh, mutable copy of a template for every container
+    def __init__(self, resource_package, yaml):
+        self.resource_package = resource_package
+        self.yaml = yaml
+        self._templates = {}
+        self._lock = threading.Lock()
+        # time spent reading and parsing templates in this process, reported by tracers
+        self.load_seconds = 0.0
+
+    def _load(self, template_name):
+        # pkg_resources is slow to import, so defer it until a template is actually read
+        started = time.perf_counter()
+        import pkg_resources
+        resource_path = '/'.join(('templates', template_name))
+        f = pkg_resources.resource_stream(self.resource_package, resource_path)
+        try:
+            return list(self.yaml.load_all(f))
+        finally:
+            f.close()
+            self.load_seconds += time.perf_counter() - started
+
+    def get(self, template_name):
+        # returns a list of documents that the caller is free to modify
+        documents = self._templates.get(template_name)
+        if documents is None:
+            with self._lock:
+                documents = self._templates.get(template_name)
+                if documents is None:
+                    documents = self._load(template_name)
+                    self._templates[template_name] = documents
+        return copy.deepcopy(documents)
+
+    def invalidate(self, template_name=None):
+        # drop one cached template, or all of them, so the next get() re-reads from disk
+        #   useful for long-lived processes where the templates can change underneath us
+        with self._lock:
+            if template_name is None:
+                self._templates.clear()
+            else:
+                self._templates.pop(template_name, None)
+
+    def cached_templates(self):
+        return sorted(self._templates)
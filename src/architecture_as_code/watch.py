@@ -0,0 +1,145 @@
+import os, threading, time
+
+from .manifest import invalidate_generator_fingerprint
+from .yaml_backend import invalidate_templates
+
+# watch mode keeps a process warm while config_main.yaml is being edited
+#
+#   aac = ArchitectureAsCode('WEBAPP')
+#   aac.watch('config_main.yaml', diagram=True)
+#
+# imports, yaml instances, parsed templates and the diagram cache stay loaded between runs, and each run
+# only re-renders what a change affects: runs are incremental, so services and environments whose inputs
+# haven't changed are skipped (see manifest.py), and the diagram is only redrawn when its model has changed
+# (see DiagramCache). files are polled rather than watched with inotify, which needs no extra dependency
+# and also works on network and container mounts, where file system events are often missed
+
+
+def template_paths():
+    # the k8s templates of the package, a change to any of them re-renders everything
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    return [os.path.join(folder, file_name) for file_name in sorted(os.listdir(folder)) if file_name.endswith('.yaml')]
+
+
+def file_state(path):
+    # (modification time, size) of a file, None while it doesn't exist, e.g. while an editor replaces it
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def print_result(result):
+    changed = ', '.join(os.path.basename(path) for path in result['changed'])
+    if result['error'] is not None:
+        print('%s: failed after %.3f s: %s' % (changed, result['run_seconds'], result['error']))
+        return
+    line = '%s: %r in %.3f s' % (changed, result['report'], result['run_seconds'])
+    if result['latency_seconds'] is not None:
+        line += ', %.3f s after the change' % result['latency_seconds']
+    print(line)
+
+
+class Watcher:
+    # polls config_main.yaml and the k8s templates every interval seconds, and regenerates once none of them
+    # has changed for debounce seconds, so a burst of saves only triggers one run
+    #   diagram: also regenerate the architecture diagram, with diagram_options passed to generate_architecture_diagram
+    #   callback: called with the result of each run, see regenerate, printed by default
+    #   call_options: passed on to ArchitectureAsCode.__call__, e.g. workers or k8s_format
+    def __init__(self, aac, config_main_file_name='config_main.yaml', interval=0.5, debounce=0.3, diagram=False, diagram_options=None,
+                 callback=print_result, **call_options):
+        self.aac = aac
+        self.config_main_file_name = config_main_file_name
+        self.interval = interval
+        self.debounce = debounce
+        self.diagram = diagram
+        # diagrams are never opened in a viewer on each change
+        self.diagram_options = dict({'show': False}, **(diagram_options or {}))
+        self.callback = callback
+        self.call_options = call_options
+        self.templates = template_paths()
+        # path -> file_state, as of the last check
+        self.states = {}
+        # seconds from each change to its regenerated output
+        self.latencies = []
+        self._stop = threading.Event()
+
+    def check(self):
+        # paths that changed since the last check
+        changed = []
+        for path in [self.config_main_file_name] + self.templates:
+            state = file_state(path)
+            if state != self.states.get(path):
+                self.states[path] = state
+                changed.append(path)
+        return changed
+
+    def regenerate(self, changed, changed_at=None):
+        # runs the generation, and the diagram, returning and passing on to the callback:
+        #   changed: paths that changed, report: the GenerationReport of the run, diagram: the diagram's file name(s)
+        #   error: the exception that stopped the run, if any, e.g. a yaml error in a half-edited file
+        #   run_seconds: time spent regenerating, latency_seconds: time from the change to the end of the run
+        started = time.perf_counter()
+        result = {'changed': changed, 'report': None, 'diagram': None, 'error': None}
+        try:
+            if any(path in self.templates for path in changed):
+                invalidate_templates()
+                invalidate_generator_fingerprint()
+            result['report'] = self.aac(config_main_file_name=self.config_main_file_name, **self.call_options)
+            if self.diagram:
+                result['diagram'] = self.aac.generate_architecture_diagram(**self.diagram_options)
+        except Exception as e:
+            result['error'] = e
+        result['run_seconds'] = time.perf_counter() - started
+        result['latency_seconds'] = None
+        if changed_at is not None:
+            result['latency_seconds'] = time.time() - changed_at
+            self.latencies.append(result['latency_seconds'])
+        if self.callback is not None:
+            self.callback(result)
+        return result
+
+    def wait_until_quiet(self, changed):
+        # adds further changes to changed until no file has changed for debounce seconds
+        #   returns False if the watcher was stopped meanwhile
+        quiet_since = time.time()
+        while time.time() - quiet_since < self.debounce:
+            if self._stop.wait(min(self.interval, self.debounce)):
+                return False
+            for path in self.check():
+                quiet_since = time.time()
+                if path not in changed:
+                    changed.append(path)
+        return True
+
+    def run(self, max_runs=None):
+        # regenerates once on start, then after every change, until stop() is called or after max_runs runs
+        self.check()
+        self.regenerate([self.config_main_file_name])
+        runs = 1
+        while (max_runs is None or runs < max_runs) and not self._stop.wait(self.interval):
+            changed = self.check()
+            if not changed:
+                continue
+            detected_at = time.time()
+            if not self.wait_until_quiet(changed):
+                break
+            # latency is counted from the last save, going by the modification times of the changed files,
+            # but not from before the change could have been detected, in case a file was copied with its old time
+            saved_at = [self.states[path][0] / 1e9 for path in changed if self.states[path] is not None]
+            changed_at = max(saved_at + [detected_at - self.interval])
+            changed_at = min(changed_at, time.time())
+            self.regenerate(changed, changed_at)
+            runs += 1
+
+    def stop(self):
+        # e.g. from another thread, or a signal handler
+        self._stop.set()
+
+    def latency_summary(self):
+        if not self.latencies:
+            return 'no changes'
+        latencies = sorted(self.latencies)
+        return '%d change%s, latency median %.3f s, max %.3f s' % (
+            len(latencies), '' if len(latencies) == 1 else 's', latencies[len(latencies) // 2], latencies[-1])
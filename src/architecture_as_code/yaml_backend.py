@@ -0,0 +1,124 @@
+import importlib.util, io, json
+
+from ruamel.yaml import YAML
+from ruamel.yaml.representer import SafeRepresenter
+from ruamel.yaml.scalarbool import ScalarBoolean
+
+from .template_registry import TemplateRegistry
+
+# yaml backends used for the k8s templates and the generated k8s files
+#   roundtrip: ruamel's comment preserving mode, as used for config_main.yaml. the default
+#   safe: ruamel's safe loader and dumper, using libyaml (C) when ruamel was installed with it.
+#         generated files have no comments to preserve, so this is much faster on large configs
+# config_main.yaml is always read with the roundtrip backend
+YAML_BACKENDS = ('roundtrip', 'safe')
+
+# k8s files can also be written as json, which kubectl accepts and which is much faster to serialize
+K8S_FORMATS = ('yaml', 'json')
+
+c_accelerated = importlib.util.find_spec('_ruamel_yaml') is not None
+
+
+class _SafeRepresenter(SafeRepresenter):
+    # the k8s documents mix plain python objects with roundtrip types copied from config_main.yaml,
+    # and the flow style lists / quoted strings built by the renderer, which the safe dumper doesn't know
+    def __init__(self, *args, **kwargs):
+        SafeRepresenter.__init__(self, *args, **kwargs)
+        # keep the key order of the templates, rather than sorting keys
+        #   set here, as the C dumper creates its own representer
+        self.sort_base_mapping_type_on_output = False
+
+
+def _represent_dict(representer, data):
+    return representer.represent_mapping('tag:yaml.org,2002:map', data)
+
+
+def _represent_list(representer, data):
+    # keep flow style lists, e.g. command: ['python']
+    flow_style = data.fa.flow_style() if hasattr(data, 'fa') else None
+    return representer.represent_sequence('tag:yaml.org,2002:seq', data, flow_style=flow_style)
+
+
+def _represent_str(representer, data):
+    # keep the quoting of ruamel's scalar strings, e.g. double quoted env var values
+    return representer.represent_scalar('tag:yaml.org,2002:str', str(data), style=getattr(data, 'style', None))
+
+
+def _represent_int(representer, data):
+    if isinstance(data, ScalarBoolean):
+        return representer.represent_bool(bool(data))
+    return representer.represent_int(int(data))
+
+
+def _represent_float(representer, data):
+    return representer.represent_float(float(data))
+
+
+_SafeRepresenter.add_multi_representer(dict, _represent_dict)
+_SafeRepresenter.add_multi_representer(list, _represent_list)
+_SafeRepresenter.add_multi_representer(str, _represent_str)
+_SafeRepresenter.add_multi_representer(int, _represent_int)
+_SafeRepresenter.add_multi_representer(float, _represent_float)
+
+
+def new_yaml(backend_name):
+    if backend_name == 'roundtrip':
+        return YAML()
+    if backend_name == 'safe':
+        yaml = YAML(typ='safe', pure=False)
+        yaml.Representer = _SafeRepresenter
+        yaml.default_flow_style = False
+        return yaml
+    raise ValueError('unknown yaml backend %r, expected one of %s' % (backend_name, ', '.join(YAML_BACKENDS)))
+
+
+class YamlBackend:
+    # a yaml instance and the k8s templates parsed with it
+    def __init__(self, name, yaml, templates):
+        self.name = name
+        self.yaml = yaml
+        self.templates = templates
+
+    def dump_k8s(self, documents, k8s_format='yaml'):
+        # text of a k8s file holding the given documents
+        #   as json, several documents are wrapped in a List, which kubectl handles like a multi-document yaml file
+        if k8s_format == 'json':
+            if len(documents) == 1:
+                return json.dumps(documents[0], indent=2) + '\n'
+            return json.dumps({'apiVersion': 'v1', 'kind': 'List', 'items': documents}, indent=2) + '\n'
+        with io.StringIO() as stream:
+            if len(documents) == 1:
+                self.yaml.dump(documents[0], stream)
+            else:
+                self.yaml.dump_all(documents, stream)
+            return stream.getvalue()
+
+
+# backend name -> YamlBackend, created on first use in each process
+_backends = {}
+
+
+def get_backend(backend_name='roundtrip'):
+    if backend_name not in _backends:
+        # the roundtrip backend shares the package's yaml instance and template registry
+        from . import yaml, k8s_templates, resource_package
+        if backend_name == 'roundtrip':
+            _backends[backend_name] = YamlBackend(backend_name, yaml, k8s_templates)
+        else:
+            backend_yaml = new_yaml(backend_name)
+            _backends[backend_name] = YamlBackend(backend_name, backend_yaml, TemplateRegistry(resource_package, backend_yaml))
+    return _backends[backend_name]
+
+
+def invalidate_templates():
+    # drop the parsed templates of every backend, so the next run re-reads them from disk
+    from . import k8s_templates
+    k8s_templates.invalidate()
+    for backend in _backends.values():
+        backend.templates.invalidate()
+
+
+def k8s_file_extension(k8s_format):
+    if k8s_format not in K8S_FORMATS:
+        raise ValueError('unknown k8s format %r, expected one of %s' % (k8s_format, ', '.join(K8S_FORMATS)))
+    return '.' + k8s_format